@@ -0,0 +1,180 @@
+"""Admission control for the API: per-client rate limits, a bounded encoder
+queue and a cap on query size.
+
+Configuration comes from the environment:
+
+    SHL_MAX_IN_FLIGHT       concurrent model.encode calls (default 4)
+    SHL_MAX_QUEUE           requests allowed to wait for an encode slot (default 16)
+    SHL_QUEUE_TIMEOUT_S     longest a request may wait for a slot (default 2)
+    SHL_RATE_LIMIT_RPS      per-client sustained requests/second (default 0 = off)
+    SHL_RATE_LIMIT_BURST    per-client burst size (default 20)
+    SHL_MAX_QUERY_CHARS     longest accepted query (default 4000)
+    SHL_OVERSIZE_POLICY     "truncate" or "reject" longer queries (default truncate)
+"""
+
+import math
+import os
+import threading
+import time
+
+from fastapi import HTTPException
+
+import metrics
+
+MAX_IN_FLIGHT = int(os.environ.get("SHL_MAX_IN_FLIGHT", "4"))
+MAX_QUEUE = int(os.environ.get("SHL_MAX_QUEUE", "16"))
+QUEUE_TIMEOUT_S = float(os.environ.get("SHL_QUEUE_TIMEOUT_S", "2"))
+RATE_LIMIT_RPS = float(os.environ.get("SHL_RATE_LIMIT_RPS", "0"))
+RATE_LIMIT_BURST = float(os.environ.get("SHL_RATE_LIMIT_BURST", "20"))
+MAX_QUERY_CHARS = int(os.environ.get("SHL_MAX_QUERY_CHARS", "4000"))
+OVERSIZE_POLICY = os.environ.get("SHL_OVERSIZE_POLICY", "truncate")
+
+
+def reject(status_code, reason, retry_after=None):
+    metrics.REJECTED.labels(reason).inc()
+    headers = {"Retry-After": str(retry_after)} if retry_after is not None else None
+    return HTTPException(status_code=status_code, detail=reason, headers=headers)
+
+
+# ------------------------------
+# Query size
+# ------------------------------
+def check_query_size(query):
+    """Truncate or reject queries longer than MAX_QUERY_CHARS, before tokenizing.
+
+    The model only reads its first 256 tokens anyway, so truncation costs
+    nothing in relevance and saves tokenizing megabyte-sized pastes.
+    """
+    if len(query) <= MAX_QUERY_CHARS:
+        return query
+    if OVERSIZE_POLICY == "reject":
+        raise reject(413, "query_too_long")
+    metrics.TRUNCATED_QUERIES.inc()
+    return query[:MAX_QUERY_CHARS]
+
+
+# ------------------------------
+# Per-client token buckets
+# ------------------------------
+class RateLimiter:
+    """Token bucket per client key, refilled at `rate` tokens/second."""
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, client):
+        """Take one token; return 0 on success or seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                self._buckets[client] = (tokens - 1, now)
+                wait = 0.0
+            else:
+                self._buckets[client] = (tokens, now)
+                wait = (1 - tokens) / self.rate
+
+            if len(self._buckets) > self.max_clients:
+                self._evict_full(now)
+        return wait
+
+    def _evict_full(self, now):
+        # A bucket that has refilled completely is the same as a missing one
+        for client, (tokens, last) in list(self._buckets.items()):
+            if tokens + (now - last) * self.rate >= self.burst:
+                del self._buckets[client]
+
+
+rate_limiter = RateLimiter(RATE_LIMIT_RPS, RATE_LIMIT_BURST)
+
+
+def client_key(request):
+    """X-Client-Id when the caller sends one, otherwise the peer address."""
+    client_id = request.headers.get("X-Client-Id")
+    if client_id:
+        return client_id
+    return request.client.host if request.client is not None else "unknown"
+
+
+def check_rate_limit(client):
+    if RATE_LIMIT_RPS <= 0:
+        return
+    wait = rate_limiter.acquire(client)
+    if wait > 0:
+        raise reject(429, "rate_limited", retry_after=math.ceil(wait))
+
+
+# ------------------------------
+# Bounded encoder queue
+# ------------------------------
+class EncoderGate:
+    """Limits concurrent encodes and sheds load once the wait queue is full.
+
+    Requests beyond max_in_flight wait for a slot; once max_queue are already
+    waiting, or a slot does not free up within timeout, the request is
+    rejected with 503 instead of piling onto the threadpool.
+    """
+
+    def __init__(self, max_in_flight, max_queue, timeout):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.waiting = 0
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        # Moving average of how long a slot is held, used for Retry-After
+        self._avg_service_s = 0.05
+
+    def retry_after(self):
+        backlog = (self.waiting + 1) / self.max_in_flight
+        return max(1, math.ceil(backlog * self._avg_service_s))
+
+    def _wait(self, timeout):
+        """(acquired, seconds waited), or None when the queue is already full."""
+        with self._lock:
+            if self.waiting >= self.max_queue:
+                return None
+            self.waiting += 1
+
+        start = time.perf_counter()
+        acquired = self._slots.acquire(timeout=max(0.0, timeout))
+        waited = time.perf_counter() - start
+        with self._lock:
+            self.waiting -= 1
+        if acquired:
+            metrics.ENCODER_IN_FLIGHT.inc()
+        return acquired, waited
+
+    def acquire(self):
+        """Wait for an encode slot and return the seconds spent waiting."""
+        result = self._wait(self.timeout)
+        if result is None:
+            raise reject(503, "queue_full", retry_after=self.retry_after())
+
+        acquired, waited = result
+        metrics.QUEUE_WAIT.observe(waited)
+        if not acquired:
+            raise reject(503, "queue_timeout", retry_after=self.retry_after())
+        return waited
+
+    def try_acquire(self, timeout):
+        """Take a slot within `timeout` seconds; False instead of rejecting.
+
+        For optional work (re-ranking) that falls back rather than failing the
+        request, so nothing is counted as shed load or queue wait.
+        """
+        result = self._wait(timeout)
+        return result is not None and result[0]
+
+    def release(self, held_s):
+        self._avg_service_s = 0.9 * self._avg_service_s + 0.1 * held_s
+        metrics.ENCODER_IN_FLIGHT.dec()
+        self._slots.release()
+
+
+encoder_gate = EncoderGate(MAX_IN_FLIGHT, MAX_QUEUE, QUEUE_TIMEOUT_S)
@@ -1,26 +1,79 @@
-from fastapi import FastAPI, Query
-from pydantic import BaseModel
-from typing import List
-from sentence_transformers import SentenceTransformer, util
-import numpy as np
 import json
+import logging
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
 
-app = FastAPI(title="SHL Assessment Recommender API")
+from fastapi import FastAPI, HTTPException, Path, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from pydantic_core import to_json
+from typing import List
 
-# Load model and data once
-model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+import admission
+import metrics
+import profiling
+import rerank
+import warmup
+from engine import (
+    CATALOG_PATH,
+    LRUCache,
+    count_tokens,
+    encode_query,
+    find_assessment,
+    load_model,
+    normalize_query,
+    open_catalog,
+    parse_field_weights,
+    rank_results,
+    score_candidates,
+    similar_results,
+)
+
+MAX_TOP_K = 10
+# Queries accepted in one /recommend/stream request
+MAX_STREAM_QUERIES = int(os.environ.get("SHL_MAX_STREAM_QUERIES", "1000"))
+ADMIN_TOKEN = os.environ.get("SHL_ADMIN_TOKEN", "")
+# e.g. "name=0.5,description=0.3,levels=0.2"; unset scores the single embedding
+FIELD_WEIGHTS = parse_field_weights(os.environ.get("SHL_FIELD_WEIGHTS", ""))
+
+logger = logging.getLogger("shl.api")
 
-with open("shl_embeddings_cleaned.json", "r", encoding="utf-8") as f:
-    raw_data = json.load(f)
 
-docs = []
-embeddings = []
+@asynccontextmanager
+async def lifespan(app):
+    start_warm_up(catalog)
+    yield
+    query_log.flush()
+
+
+app = FastAPI(title="SHL Assessment Recommender API", lifespan=lifespan)
+app.add_middleware(metrics.RequestMetricsMiddleware)
+
+# Load model and data once
+model = load_model()
+catalog = open_catalog(CATALOG_PATH, model, FIELD_WEIGHTS)
+metrics.set_catalog(len(catalog.docs), catalog.version)
+
+embedding_cache = LRUCache(int(os.environ.get("SHL_EMBEDDING_CACHE_SIZE", "1024")))
+metrics.track_cache("embedding", embedding_cache)
+reranker = (
+    rerank.Reranker(gate=admission.encoder_gate) if rerank.RERANK_ENABLED else None
+)
+if reranker is not None:
+    metrics.track_cache("rerank", reranker.cache)
+# Bi-encoder candidates kept per query: enough for top_k and for re-ranking
+CANDIDATES = max(MAX_TOP_K, reranker.top_n) if reranker is not None else MAX_TOP_K
 
-for entry in raw_data:
-    docs.append(entry)
-    embeddings.append(np.array(entry["embedding"], dtype=np.float32))
+# Keyed by (normalized query, catalog version); holds the CANDIDATES best
+# unique rows so any top_k / min_score can be answered by slicing
+result_cache = LRUCache(int(os.environ.get("SHL_RESULT_CACHE_SIZE", "1024")))
+metrics.track_cache("result", result_cache)
 
-embeddings = np.stack(embeddings)
+query_log = warmup.QueryLog(warmup.QUERY_LOG_PATH)
+ready = threading.Event()
+reload_lock = threading.Lock()
 
 
 # Define response model
@@ -34,45 +87,345 @@ class Assessment(BaseModel):
     score: float
 
 
+def build_assessments(docs, ranked):
+    return [
+        Assessment(
+            name=docs[idx]["name"],
+            url=docs[idx]["url"],
+            duration=docs[idx].get("duration", ""),
+            test_type=docs[idx].get("test_type", ""),
+            remote_testing=docs[idx].get("remote_testing", ""),
+            adaptive_irt=docs[idx].get("adaptive_irt", ""),
+            score=score,
+        )
+        for idx, score in ranked
+    ]
+
+
+# Per catalog version: each row's response JSON up to its score, validated
+# against Assessment once when built instead of on every response
+row_json = {}
+
+
+def encode_rows(docs):
+    """b'{"name":...,"adaptive_irt":...,"score":' for every catalog row."""
+    rows = []
+    for doc in docs:
+        fields = Assessment(
+            name=doc["name"],
+            url=doc["url"],
+            duration=doc.get("duration", ""),
+            test_type=doc.get("test_type", ""),
+            remote_testing=doc.get("remote_testing", ""),
+            adaptive_irt=doc.get("adaptive_irt", ""),
+            score=0.0,
+        ).model_dump(exclude={"score"})
+        # Same encoding as FastAPI's default JSON response
+        text = json.dumps(fields, ensure_ascii=False, separators=(",", ":"))
+        rows.append(text[:-1].encode("utf-8") + b',"score":')
+    return rows
+
+
+def catalog_rows(snapshot):
+    rows = row_json.get(snapshot.version)
+    if rows is None:
+        rows = encode_rows(snapshot.docs)
+        # Only the live catalog (and one being warmed for reload) matter
+        if len(row_json) >= 2:
+            row_json.clear()
+        row_json[snapshot.version] = rows
+    return rows
+
+
+def assessments_json(snapshot, ranked):
+    """JSON array of Assessments for (index, score) pairs, as bytes."""
+    rows = catalog_rows(snapshot)
+    # Scores are formatted as pydantic renders a float field (0.00001, 2e-7, null)
+    body = b",".join(
+        rows[idx] + to_json(score, inf_nan_mode="null") + b"}" for idx, score in ranked
+    )
+    return b"[" + body + b"]"
+
+
+def render_assessments(snapshot, ranked):
+    """JSON response for (index, score) pairs, as List[Assessment] would render.
+
+    Returning a Response skips FastAPI's response_model re-validation; the
+    route keeps response_model for the OpenAPI schema.
+    """
+    return Response(
+        content=assessments_json(snapshot, ranked), media_type="application/json"
+    )
+
+
+class StreamRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1, max_length=MAX_STREAM_QUERIES)
+    top_k: int = Field(5, ge=1, le=MAX_TOP_K, description="Results per query")
+    min_score: float = Field(
+        0.5, ge=0.0, le=1.0, description="Minimum cosine similarity score"
+    )
+
+
+def cached_encode(query, key, trace):
+    query_embedding = embedding_cache.get(key)
+    metrics.record_cache_lookup("embedding", query_embedding is not None)
+    if query_embedding is not None:
+        return query_embedding
+
+    # Only cache misses need the model, so only they go through the encoder queue
+    trace.stages["queue"] = admission.encoder_gate.acquire()
+    start = time.perf_counter()
+    try:
+        with trace.stage("encode"):
+            metrics.ENCODER_BATCH_SIZE.observe(1)
+            query_embedding = encode_query(model, query)
+    finally:
+        admission.encoder_gate.release(time.perf_counter() - start)
+
+    embedding_cache.put(key, query_embedding)
+    return query_embedding
+
+
+# ------------------------------
+# Cache warm-up
+# ------------------------------
+def warm_batch(snapshot, batch):
+    """Fill the embedding and result caches for a batch of normalized queries."""
+    missing = [query for query in batch if embedding_cache.peek(query) is None]
+    if missing:
+        metrics.ENCODER_BATCH_SIZE.observe(len(missing))
+        batch_embeddings = model.encode(
+            missing, batch_size=len(missing), convert_to_tensor=True
+        )
+        for query, query_embedding in zip(missing, batch_embeddings):
+            embedding_cache.put(query, query_embedding)
+
+    for query in batch:
+        query_embedding = embedding_cache.peek(query)
+        if query_embedding is None:
+            continue
+        indices, scores = score_candidates(
+            query_embedding, snapshot, FIELD_WEIGHTS, depth=CANDIDATES
+        )
+        result_cache.put(
+            (query, snapshot.version),
+            rank_results(snapshot.docs, scores, CANDIDATES, indices=indices),
+        )
+
+
+def warm_up(snapshot):
+    try:
+        query_log.compact()
+        queries = query_log.top(warmup.WARMUP_QUERIES)
+        catalog_rows(snapshot)
+        warmed, seconds = warmup.warm(queries, lambda b: warm_batch(snapshot, b))
+        logger.info("warmed %d queries in %.1fs", warmed, seconds)
+    except Exception:
+        logger.exception("cache warm-up failed; serving cold")
+
+
+def start_warm_up(snapshot):
+    def run():
+        try:
+            if reranker is not None:
+                reranker.model  # load the cross-encoder before taking traffic
+        except Exception:
+            logger.exception("cross-encoder failed to load; serving without it")
+        try:
+            warm_up(snapshot)
+        finally:
+            ready.set()
+
+    ready.clear()
+    threading.Thread(target=run, name="cache-warm-up", daemon=True).start()
+
+
+def reload_catalog(path=CATALOG_PATH):
+    """Load the catalog from disk, warm its caches, then swap it in."""
+    global catalog
+
+    with reload_lock:
+        snapshot = open_catalog(path, model, FIELD_WEIGHTS)
+        if snapshot.version == catalog.version:
+            return False
+
+        ready.clear()
+        # The old catalog keeps serving while the new one warms up
+        warm_up(snapshot)
+        catalog = snapshot
+        metrics.set_catalog(len(snapshot.docs), snapshot.version)
+        ready.set()
+        return True
+
+
+def search(snapshot, query, key, min_score, trace, start):
+    """Ranked (index, score) pairs for a size-checked query, through the caches."""
+    ranked = result_cache.get((key, snapshot.version))
+    metrics.record_cache_lookup("result", ranked is not None)
+    if ranked is None:
+        query_embedding = cached_encode(query, key, trace)
+        with trace.stage("score"):
+            indices, scores = score_candidates(
+                query_embedding, snapshot, FIELD_WEIGHTS, depth=CANDIDATES
+            )
+        with trace.stage("rank"):
+            ranked = rank_results(snapshot.docs, scores, CANDIDATES, indices=indices)
+        result_cache.put((key, snapshot.version), ranked)
+
+    ranked = [(idx, score) for idx, score in ranked if score >= min_score]
+    if reranker is not None:
+        with trace.stage("rerank"):
+            ranked, _ = reranker.rerank(
+                query, snapshot.docs, ranked, time.perf_counter() - start
+            )
+    return ranked
+
+
+# ------------------------------
+# Endpoints
+# ------------------------------
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/ready", include_in_schema=False)
+def readiness(response: Response):
+    if not ready.is_set():
+        response.status_code = 503
+        return {"status": "warming", "catalog_version": catalog.version}
+    return {"status": "ready", "catalog_version": catalog.version}
+
+
+@app.post("/admin/reload", include_in_schema=False)
+def admin_reload(request: Request):
+    if not ADMIN_TOKEN or request.headers.get("X-Admin-Token") != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="forbidden")
+    reloaded = reload_catalog()
+    return {"reloaded": reloaded, "catalog_version": catalog.version}
+
+
 @app.get("/recommend", response_model=List[Assessment])
 def recommend_assessments(
+    request: Request,
     query: str = Query(..., description="Natural language query or JD"),
     top_k: int = Query(5, ge=1, le=10, description="Number of results to return"),
     min_score: float = Query(
         0.5, ge=0.0, le=1.0, description="Minimum cosine similarity score"
     ),
 ):
-    query_embedding = model.encode(query, convert_to_tensor=True)
-    scores = util.cos_sim(query_embedding, embeddings)[0].cpu().numpy()
-    sorted_indices = scores.argsort()[::-1]
+    start = time.perf_counter()
+    admission.check_rate_limit(admission.client_key(request))
+    query = admission.check_query_size(query)
+    key = normalize_query(query)
+    query_log.record(key)
 
-    seen = set()
-    results = []
+    snapshot = catalog
+    trace = profiling.QueryTrace(
+        query,
+        "api",
+        profile=profiling.should_profile(
+            request.headers.get(profiling.PROFILE_HEADER) == "1"
+        ),
+        on_stage=metrics.observe_stage,
+        token_counter=lambda text: count_tokens(model, text),
+    )
 
-    for idx in sorted_indices:
-        doc = docs[idx]
-        name_url = (doc["name"], doc["url"])
-        if name_url in seen:
-            continue
-        seen.add(name_url)
+    with trace:
+        ranked = search(snapshot, query, key, min_score, trace, start)
+        with trace.stage("serialize"):
+            ranked = ranked[:top_k]
+            result = render_assessments(snapshot, ranked)
+        trace.result_count = len(ranked)
 
-        score = float(scores[idx])
-        if score < min_score:
-            continue
+    if trace.profile_id is not None:
+        result.headers["X-Profile-Id"] = trace.profile_id
+    return result
 
-        results.append(
-            Assessment(
-                name=doc["name"],
-                url=doc["url"],
-                duration=doc.get("duration", ""),
-                test_type=doc.get("test_type", ""),
-                remote_testing=doc.get("remote_testing", ""),
-                adaptive_irt=doc.get("adaptive_irt", ""),
-                score=score,
-            )
-        )
 
-        if len(results) >= top_k:
-            break
+@app.post("/recommend/stream")
+def recommend_stream(
+    request: Request,
+    body: StreamRequest,
+    format: str = Query(
+        "ndjson",
+        pattern="^(ndjson|sse)$",
+        description="ndjson: one JSON line per query; sse: server-sent events",
+    ),
+):
+    """Results for a batch of queries, each sent as soon as it is ranked.
+
+    Every item is {"index": i, "results": [Assessment, ...]} or, when that
+    query was shed or rejected, {"index": i, "error": reason}; items arrive
+    in query order. Each query takes its own rate-limit token: the first is
+    checked up front (429), later ones become "rate_limited" error items.
+    SSE sends them as `result` events and ends with `done`.
+    Queries are handled one at a time, so memory stays flat however long
+    the batch is.
+    """
+    client = admission.client_key(request)
+    admission.check_rate_limit(client)
+    snapshot = catalog
+    sse = format == "sse"
+
+    def items():
+        for i, raw_query in enumerate(body.queries):
+            start = time.perf_counter()
+            try:
+                if i > 0:
+                    admission.check_rate_limit(client)
+                query = admission.check_query_size(raw_query)
+                key = normalize_query(query)
+                query_log.record(key)
+                trace = profiling.QueryTrace(
+                    query,
+                    "api-stream",
+                    on_stage=metrics.observe_stage,
+                    token_counter=lambda text: count_tokens(model, text),
+                )
+                with trace:
+                    ranked = search(snapshot, query, key, body.min_score, trace, start)
+                    ranked = ranked[: body.top_k]
+                    trace.result_count = len(ranked)
+                item = b'{"index":%d,"results":%s}' % (
+                    i,
+                    assessments_json(snapshot, ranked),
+                )
+            except HTTPException as exc:
+                error = {"index": i, "error": exc.detail}
+                if exc.headers and "Retry-After" in exc.headers:
+                    error["retry_after"] = int(exc.headers["Retry-After"])
+                item = json.dumps(error).encode()
+
+            if sse:
+                yield b"event: result\ndata: " + item + b"\n\n"
+            else:
+                yield item + b"\n"
+        if sse:
+            yield b"event: done\ndata: {}\n\n"
+
+    # A sync generator is iterated in the threadpool, so encoding never blocks
+    # the event loop; X-Accel-Buffering stops nginx from holding items back
+    return StreamingResponse(
+        items(),
+        media_type="text/event-stream" if sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/similar/{assessment}", response_model=List[Assessment])
+def similar_assessments(
+    assessment: str = Path(
+        ..., description="Assessment URL slug (last part of its URL) or exact name"
+    ),
+    top_k: int = Query(5, ge=1, le=10, description="Number of results to return"),
+):
+    snapshot = catalog
+    idx = find_assessment(snapshot, assessment)
+    if idx is None:
+        raise HTTPException(status_code=404, detail="unknown assessment")
 
-    return results
+    # Served straight from the precomputed neighbour graph, no encoding
+    ranked = similar_results(snapshot, idx, top_k)
+    return render_assessments(snapshot, ranked)
@@ -4,35 +4,49 @@ st.set_page_config(
     layout="wide",
     page_icon="🔍"
 )
-import json
 import numpy as np
-from sentence_transformers import SentenceTransformer, util
 import pandas as pd
 import io
+import os
+
+import profiling
+from engine import (
+    count_tokens,
+    encode_query,
+    load_model,
+    open_catalog,
+    parse_field_weights,
+    rank_results,
+    score_catalog,
+    similar_results,
+)
 
 
-# Load model + cache data
+# Load model + cache data, once per server process and shared by all sessions
 @st.cache_resource
-def load_model():
-    return SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+def load_engine():
+    model = load_model()
+    return model, open_catalog(model=model, field_weights=FIELD_WEIGHTS)
+
 
+@st.cache_resource
+def load_filters(_catalog, version):
+    """Boolean row masks for the sidebar filters, per catalog version."""
 
-@st.cache_data
-def load_data():
-    with open("shl_embeddings_cleaned.json", "r", encoding="utf-8") as f:
-        raw = json.load(f)
+    def is_yes(field):
+        return np.array(
+            [doc.get(field, "").strip().lower() == "yes" for doc in _catalog.docs]
+        )
 
-    docs = []
-    embeddings = []
-    for entry in raw:
-        docs.append(entry)
-        embeddings.append(np.array(entry["embedding"], dtype=np.float32))
+    return {"remote": is_yes("remote_testing"), "adaptive": is_yes("adaptive_irt")}
 
-    return docs, np.stack(embeddings)
 
+# Same setting as the API, e.g. "name=0.5,description=0.3,levels=0.2"
+FIELD_WEIGHTS = parse_field_weights(os.environ.get("SHL_FIELD_WEIGHTS", ""))
 
-model = load_model()
-docs, embeddings = load_data()
+model, catalog = load_engine()
+docs = catalog.docs
+filters = load_filters(catalog, catalog.version)
 
 # ------------------------------
 # UI Layout
@@ -59,43 +73,113 @@ with col2:
 # ------------------------------
 # Helper: Run search
 # ------------------------------
-def find_best_matches(user_query, top_k=5):
-    query_embedding = model.encode(user_query, convert_to_tensor=True)
-    scores = util.cos_sim(query_embedding, embeddings)[0].cpu().numpy()
-    sorted_indices = scores.argsort()[::-1]
-
-    seen = set()
-    results = []
-
-    for idx in sorted_indices:
-        doc = docs[idx]
-        if (doc["name"], doc["url"]) in seen:
-            continue
-        seen.add((doc["name"], doc["url"]))
-
-        results.append(
-            {
-                "name": doc["name"],
-                "url": doc["url"],
-                "score": float(scores[idx]),
-                "description": doc.get("description", ""),
-                "duration": doc.get("duration", ""),
-                "test_type": doc.get("test_type", ""),
-                "remote_testing": doc.get("remote_testing", ""),
-                "adaptive_irt": doc.get("adaptive_irt", ""),
-            }
-        )
-
-        if len(results) == top_k:
-            break
+def result_row(idx, score):
+    doc = docs[idx]
+    return {
+        "index": int(idx),
+        "name": doc["name"],
+        "url": doc["url"],
+        "score": float(score),
+        "description": doc.get("description", ""),
+        "duration": doc.get("duration", ""),
+        "test_type": doc.get("test_type", ""),
+        "remote_testing": doc.get("remote_testing", ""),
+        "adaptive_irt": doc.get("adaptive_irt", ""),
+    }
+
+
+def score_search(user_query, trace, progress):
+    """Query embedding and full score vector, kept in session state.
+
+    Re-running the same query (e.g. pressing the button again, or moving a
+    widget afterwards) reuses them instead of adding encode/score stages.
+    """
+    search = st.session_state.get("search")
+    if (
+        search is not None
+        and search["query"] == user_query
+        and search["version"] == catalog.version
+    ):
+        return search
+
+    progress("Encoding the query...")
+    with trace.stage("encode"):
+        query_embedding = encode_query(model, user_query)
+    # Every row is scored (no two-stage shortlist) so that any filter
+    # combination can be answered from this one vector
+    progress("Scoring the catalog...")
+    with trace.stage("score"):
+        scores = score_catalog(query_embedding, catalog, FIELD_WEIGHTS)
+
+    search = {
+        "query": user_query,
+        "version": catalog.version,
+        "embedding": query_embedding,
+        "scores": scores,
+    }
+    st.session_state["search"] = search
+    return search
+
+
+def find_best_matches(
+    user_query, top_k=5, remote_only=False, adaptive_only=False, progress=None
+):
+    """Top results for a query, re-ranking session-cached scores when possible.
+
+    progress(label) is called as each stage starts.
+    """
+    progress = progress or (lambda label: None)
+    trace = profiling.QueryTrace(
+        user_query,
+        "streamlit",
+        profile=profiling.should_profile(),
+        token_counter=lambda text: count_tokens(model, text),
+    )
+
+    with trace:
+        search = score_search(user_query, trace, progress)
+
+        mask = None
+        if remote_only:
+            mask = filters["remote"]
+        if adaptive_only:
+            mask = filters["adaptive"] if mask is None else mask & filters["adaptive"]
+
+        progress("Ranking...")
+        with trace.stage("rank"):
+            ranked = rank_results(docs, search["scores"], top_k, mask=mask)
+            results = [result_row(idx, score) for idx, score in ranked]
+
+        trace.result_count = len(results)
 
     return results
 
 
+def find_similar(idx, top_k=5):
+    # Precomputed neighbour graph: no model.encode on this path
+    return [result_row(j, score) for j, score in similar_results(catalog, idx, top_k)]
+
+
+def show_result(res, more_like_this=False):
+    with st.container():
+        st.markdown(f"### 🔹 [{res['name']}]({res['url']})")
+        col1, col2, col3 = st.columns(3)
+        col1.markdown(f"⏱️ **Duration**: {res['duration']}")
+        col2.markdown(f"🔬 **Type**: {res['test_type']}")
+        col3.markdown(f"📈 **Score**: {res['score']:.2f}")
+        st.markdown(
+            f"🛰️ **Remote Testing**: {res['remote_testing']} | 🧠 **IRT**: {res['adaptive_irt']}"
+        )
+        st.markdown(f"*{res['description']}*")
+        if more_like_this and st.button("🔁 More like this", key=f"more-{res['index']}"):
+            st.session_state["similar_to"] = res["index"]
+        st.markdown("---")
+
 
 # ------------------------------
 # Trigger search
 # ------------------------------
+results = None
 if st.button("🔍 Find Recommendations"):
     query = query_text.strip()
 
@@ -105,24 +189,37 @@ if st.button("🔍 Find Recommendations"):
     if not query:
         st.warning("Please enter a query or upload a file.")
     else:
-        with st.spinner("Thinking..."):
-            results = find_best_matches(query, top_k=top_k)
-
-        if not results:
-            st.error("No relevant assessments found.")
-        else:
-            st.success(f"Top {len(results)} assessments matched!")
-
-            # Display results
-            for res in results:
-                with st.container():
-                    st.markdown(f"### 🔹 [{res['name']}]({res['url']})")
-                    col1, col2, col3 = st.columns(3)
-                    col1.markdown(f"⏱️ **Duration**: {res['duration']}")
-                    col2.markdown(f"🔬 **Type**: {res['test_type']}")
-                    col3.markdown(f"📈 **Score**: {res['score']:.2f}")
-                    st.markdown(
-                        f"🛰️ **Remote Testing**: {res['remote_testing']} | 🧠 **IRT**: {res['adaptive_irt']}"
-                    )
-                    st.markdown(f"*{res['description']}*")
-                    st.markdown("---")
+        # Each stage reports as it starts, so a long JD shows where the time
+        # goes instead of a bare spinner; results render as soon as ranked
+        with st.status("Searching...") as status:
+            results = find_best_matches(
+                query,
+                top_k,
+                filter_remote,
+                filter_adaptive,
+                progress=lambda label: status.update(label=label),
+            )
+            status.update(label=f"Ranked {len(results)} assessments", state="complete")
+        st.session_state["query"] = query
+        st.session_state.pop("similar_to", None)
+
+# The scores stay in session state, so moving the slider or toggling a filter
+# only re-ranks them: no encoding and no button press needed
+query = st.session_state.get("query")
+if query is not None:
+    if results is None:
+        results = find_best_matches(query, top_k, filter_remote, filter_adaptive)
+    if not results:
+        st.error("No relevant assessments found.")
+    else:
+        st.success(f"Top {len(results)} assessments matched!")
+
+        # Display results
+        for res in results:
+            show_result(res, more_like_this=True)
+
+similar_to = st.session_state.get("similar_to")
+if similar_to is not None:
+    st.subheader(f"🔁 Assessments like {docs[similar_to]['name']}")
+    for res in find_similar(similar_to, top_k=top_k):
+        show_result(res)
@@ -0,0 +1,67 @@
+"""Interaction latency of the Streamlit app, driven headlessly with AppTest.
+
+For each query: type it and press the search button, then move the Top N
+slider, then toggle the remote-testing filter, timing each full script
+rerun. The model and catalog load once and are not counted.
+
+    python bench_app.py
+    python bench_app.py --app old_app.py --click-after-change
+
+--click-after-change presses the search button after every slider or
+filter change as well. That is how an app that only ranks on a button
+press has to be driven, so it gives the "before" numbers to compare with.
+"""
+
+import argparse
+import time
+
+from streamlit.testing.v1 import AppTest
+
+from benchmark import load_queries, summarize
+
+
+def timed(step):
+    start = time.perf_counter()
+    step()
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app", default="app.py")
+    parser.add_argument("--queries", default="benchmark_queries.txt")
+    parser.add_argument("--click-after-change", action="store_true")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    queries = load_queries(args.queries)
+    at = AppTest.from_file(args.app, default_timeout=args.timeout)
+    at.run()  # loads the model and catalog into the resource cache
+
+    samples = {"search": [], "top_n": [], "filter": []}
+    for i, query in enumerate(queries):
+        at.text_area[0].input(query)
+        samples["search"].append(timed(lambda: at.button[0].click().run()))
+
+        at.slider[0].set_value(10 if i % 2 == 0 else 3)
+        if args.click_after_change:
+            at.button[0].click()
+        samples["top_n"].append(timed(at.run))
+
+        at.checkbox[0].set_value(not at.checkbox[0].value)
+        if args.click_after_change:
+            at.button[0].click()
+        samples["filter"].append(timed(at.run))
+
+        if at.exception:
+            raise SystemExit(f"app raised: {at.exception[0].value}")
+
+    print(f"{len(queries)} queries against {args.app}")
+    print(f"{'step':>8} {'p50 ms':>9} {'p95 ms':>9}")
+    for step, values in samples.items():
+        stats = summarize(values)
+        print(f"{step:>8} {stats['p50']:>9.1f} {stats['p95']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""Retrieval micro-benchmark on large synthetic catalogs.
+
+Synthetic rows are noisy mixtures of the real catalog embeddings, so they
+keep some of its structure. For each catalog size this times the full
+float32 scan against two-stage search (PCA coarse scan + full re-scoring of
+a shortlist) and reports recall@k of the two-stage top-k against the exact
+one. With --shards it also times the sharded full scan on 1..N threads
+and reports the speed-up and scaling efficiency (speed-up / threads) over
+one shard. No model is needed:
+
+    python bench_retrieval.py --sizes 10000,100000,300000 --dims 64,128
+    python bench_retrieval.py --sizes 1000000 --dims "" --shards 1,2,4,8
+
+BLAS is limited to one thread per shard while timing (when threadpoolctl is
+installed), so the scaling comes from the shards alone.
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+import torch
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:  # optional: BLAS keeps its own threads
+    threadpool_limits = None
+
+from benchmark import summarize
+from engine import (
+    SHARD_DEPTH,
+    Catalog,
+    build_coarse_index,
+    load_catalog,
+    rank_results,
+    score_candidates,
+    sharded_top_k,
+    unit_matrix,
+    unit_query,
+    unit_rows,
+)
+
+
+def synthetic_embeddings(base, n, noise, rng, mix=3):
+    """n rows, each a random convex mix of `mix` real rows plus Gaussian noise."""
+    base = unit_rows(base)
+    out = np.empty((n, base.shape[1]), dtype=np.float32)
+    for r0 in range(0, n, 65536):
+        m = min(65536, n - r0)
+        picks = rng.integers(0, len(base), size=(m, mix))
+        weights = rng.dirichlet(np.ones(mix), size=m).astype(np.float32)
+        block = np.einsum("rm,rmd->rd", weights, base[picks])
+        block += (
+            noise
+            * rng.standard_normal(block.shape, dtype=np.float32)
+            / np.sqrt(base.shape[1])
+        )
+        out[r0 : r0 + m] = unit_rows(block)
+    return out
+
+
+def synthetic_catalog(embeddings, index):
+    docs = [{"name": f"a{i}", "url": f"u{i}"} for i in range(len(embeddings))]
+    # The version keys the engine's matrix caches, so it must differ per size
+    return Catalog(docs, embeddings, f"synthetic-{len(docs)}", index, {})
+
+
+def time_search(catalog, queries, top_k, shortlist):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        indices, scores = score_candidates(query, catalog, shortlist=shortlist)
+        ranked = rank_results(catalog.docs, scores, top_k, indices=indices)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append([idx for idx, _ in ranked])
+    return summarize(latencies), results
+
+
+def time_sharded(catalog, queries, top_k, shards):
+    """Like time_search, through the scatter-gather scan with `shards` threads.
+
+    One shard is the same scan without the thread pool, i.e. the baseline.
+    """
+    matrix = unit_matrix(catalog)
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        ids, scores = sharded_top_k(matrix, unit_query(query), SHARD_DEPTH, shards)
+        ranked = rank_results(catalog.docs, scores, top_k, indices=ids)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append([idx for idx, _ in ranked])
+    return summarize(latencies), results
+
+
+def recall(exact, approx, top_k):
+    hits = sum(len(set(e) & set(a)) for e, a in zip(exact, approx))
+    return hits / (len(exact) * top_k)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000,300000")
+    parser.add_argument("--dims", default="64,128", help="PCA dimensions to try")
+    parser.add_argument("--shortlists", default="256,1024")
+    parser.add_argument(
+        "--shards", default="", help='Thread counts for the scaling run, e.g. "1,2,4"'
+    )
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--noise", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the results as JSON")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    _, base = load_catalog()
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    dims = [int(d) for d in args.dims.split(",") if d]
+    shortlists = [int(s) for s in args.shortlists.split(",") if s]
+    shard_counts = [int(s) for s in args.shards.split(",") if s]
+    blas_limit = threadpool_limits(1) if threadpool_limits and shard_counts else None
+
+    queries = [
+        torch.from_numpy(row)
+        for row in synthetic_embeddings(base, args.queries, args.noise, rng)
+    ]
+
+    rows = []
+    print(
+        f"{'rows':>9} {'mode':>18} {'p50 ms':>9} {'p95 ms':>9} "
+        f"{'recall@' + str(args.top_k):>10} {'var kept':>9}"
+    )
+    for n in sizes:
+        embeddings = synthetic_embeddings(base, n, args.noise, rng)
+        catalog = synthetic_catalog(embeddings, {})
+        full_latency, exact = time_search(catalog, queries, args.top_k, 0)
+        rows.append(
+            {"rows": n, "mode": "full", "latency_ms": full_latency, "recall": 1.0}
+        )
+        print(
+            f"{n:>9} {'full scan':>18} {full_latency['p50']:>9.2f} "
+            f"{full_latency['p95']:>9.2f} {1.0:>10.3f}"
+        )
+
+        base_p50 = None
+        for shards in shard_counts:
+            latency, approx = time_sharded(catalog, queries, args.top_k, shards)
+            base_p50 = base_p50 or latency["p50"]
+            speedup = base_p50 / latency["p50"]
+            r = recall(exact, approx, args.top_k)
+            rows.append(
+                {
+                    "rows": n,
+                    "mode": "sharded",
+                    "shards": shards,
+                    "latency_ms": latency,
+                    "recall": r,
+                    "speedup": speedup,
+                    "efficiency": speedup / shards,
+                }
+            )
+            mode = f"{shards} shards"
+            print(
+                f"{n:>9} {mode:>18} {latency['p50']:>9.2f} {latency['p95']:>9.2f} "
+                f"{r:>10.3f} {'':>9} x{speedup:.2f} ({speedup / shards:.0%})"
+            )
+
+        for d in dims:
+            start = time.perf_counter()
+            index = build_coarse_index(embeddings, d)
+            build_s = time.perf_counter() - start
+            catalog = synthetic_catalog(embeddings, index)
+            for shortlist in shortlists:
+                latency, approx = time_search(catalog, queries, args.top_k, shortlist)
+                r = recall(exact, approx, args.top_k)
+                explained = float(index["pca_explained"])
+                rows.append(
+                    {
+                        "rows": n,
+                        "mode": "two_stage",
+                        "pca_dims": d,
+                        "shortlist": shortlist,
+                        "latency_ms": latency,
+                        "recall": r,
+                        "explained_variance": explained,
+                        "build_s": build_s,
+                    }
+                )
+                mode = f"pca{d}/sl{shortlist}"
+                print(
+                    f"{n:>9} {mode:>18} {latency['p50']:>9.2f} {latency['p95']:>9.2f} "
+                    f"{r:>10.3f} {explained:>9.1%}"
+                )
+
+    if blas_limit is not None:
+        blas_limit.unregister()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
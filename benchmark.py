@@ -0,0 +1,397 @@
+"""Latency / throughput benchmark for the /recommend endpoint.
+
+Replays a query corpus against api.py at fixed concurrency levels, times each
+search stage in-process, and writes the numbers to JSON so a later run can be
+compared against a stored baseline:
+
+    python benchmark.py --output bench_baseline.json
+    python benchmark.py --baseline bench_baseline.json --tolerance 0.2
+
+The corpus repeats, so after the first pass requests hit the API's caches;
+set SHL_EMBEDDING_CACHE_SIZE=0 SHL_RESULT_CACHE_SIZE=0 to measure the
+uncached path.
+"""
+
+import argparse
+import json
+import os
+import platform
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+import numpy as np
+
+STAGES = ["encode", "score", "rank", "serialize"]
+# Scores whose JSON differs from repr(): 1e-05 -> 0.00001, nan -> null, ...
+EDGE_SCORES = [1e-05, 2e-07, -0.0, 1e16, float("nan"), float("inf"), float("-inf")]
+
+
+# ------------------------------
+# Helpers
+# ------------------------------
+def load_queries(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def summarize(samples_ms):
+    """p50/p95/p99/mean of a list of millisecond samples."""
+    arr = np.asarray(samples_ms, dtype=np.float64)
+    if arr.size == 0:
+        return {"p50": None, "p95": None, "p99": None, "mean": None}
+    return {
+        "p50": float(np.percentile(arr, 50)),
+        "p95": float(np.percentile(arr, 95)),
+        "p99": float(np.percentile(arr, 99)),
+        "mean": float(arr.mean()),
+    }
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(app, port):
+    """Run the FastAPI app with uvicorn on a background thread."""
+    import uvicorn
+
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+
+    deadline = time.time() + 30
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("uvicorn did not start within 30s")
+        time.sleep(0.05)
+
+    return server, thread
+
+
+# ------------------------------
+# Load test
+# ------------------------------
+def run_level(base_url, queries, concurrency, n_requests, top_k, min_score):
+    """Fire n_requests at the given concurrency; return latency and throughput."""
+
+    def one(i):
+        params = urlencode(
+            {"query": queries[i % len(queries)], "top_k": top_k, "min_score": min_score}
+        )
+        start = time.perf_counter()
+        try:
+            with urlopen(f"{base_url}/recommend?{params}", timeout=60) as resp:
+                resp.read()
+                ok = resp.status == 200
+        except Exception:
+            ok = False
+        return (time.perf_counter() - start) * 1000, ok
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(one, range(n_requests)))
+    wall = time.perf_counter() - wall_start
+
+    latencies = [ms for ms, ok in outcomes if ok]
+    return {
+        "concurrency": concurrency,
+        "requests": n_requests,
+        "errors": sum(1 for _, ok in outcomes if not ok),
+        "rps": len(latencies) / wall if wall > 0 else 0.0,
+        "latency_ms": summarize(latencies),
+    }
+
+
+# ------------------------------
+# Per-stage timing
+# ------------------------------
+def time_stages(api, queries, repeats, top_k, min_score):
+    """Time encode / score / rank / serialize for each query, in-process."""
+    from engine import encode_query, rank_results, score_candidates
+
+    samples = {stage: [] for stage in STAGES}
+
+    for _ in range(repeats):
+        for query in queries:
+            t0 = time.perf_counter()
+            query_embedding = encode_query(api.model, query)
+            t1 = time.perf_counter()
+            indices, scores = score_candidates(
+                query_embedding, api.catalog, api.FIELD_WEIGHTS, depth=top_k
+            )
+            t2 = time.perf_counter()
+            ranked = rank_results(
+                api.catalog.docs, scores, top_k, min_score=min_score, indices=indices
+            )
+            t3 = time.perf_counter()
+            api.render_assessments(api.catalog, ranked)
+            t4 = time.perf_counter()
+
+            samples["encode"].append((t1 - t0) * 1000)
+            samples["score"].append((t2 - t1) * 1000)
+            samples["rank"].append((t3 - t2) * 1000)
+            samples["serialize"].append((t4 - t3) * 1000)
+
+    return {stage: summarize(values) for stage, values in samples.items()}
+
+
+def instrumentation_overhead(iterations=20000):
+    """Per-request cost (microseconds) of the tracing and metrics on /recommend.
+
+    Covers the request middleware as well as the per-stage tracing: a bare
+    ASGI app is timed with and without both, in the same event loop.
+    """
+    import asyncio
+    from types import SimpleNamespace
+
+    import metrics
+    from profiling import QueryTrace
+
+    route = SimpleNamespace(path="/recommend")
+    scope = {"type": "http", "method": "GET", "path": "/recommend"}
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        pass
+
+    async def bare_app(scope, receive, send):
+        scope["route"] = route
+        for stage in STAGES:
+            pass
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"[]"})
+
+    async def traced_app(scope, receive, send):
+        scope["route"] = route
+        with QueryTrace("", "benchmark", on_stage=metrics.observe_stage) as trace:
+            for stage in STAGES:
+                with trace.stage(stage):
+                    pass
+        metrics.record_cache_lookup("embedding", True)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"[]"})
+
+    async def run(app):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            await app(dict(scope), receive, send)
+        return time.perf_counter() - start
+
+    instrumented = asyncio.run(run(metrics.RequestMetricsMiddleware(traced_app)))
+    bare = asyncio.run(run(bare_app))
+    return (instrumented - bare) / iterations * 1e6
+
+
+def serialization_cost(api, sizes=(5, 10, 100), iterations=2000):
+    """Microseconds per response: pydantic + response_model vs. pre-encoded rows.
+
+    The first path is what /recommend did before render_assessments: build
+    Assessment models, then let FastAPI validate and serialize them against
+    the route's response_model. Both must produce the same bytes, including
+    for tiny and non-finite scores.
+    """
+    import asyncio
+
+    from fastapi.routing import serialize_response
+
+    route = next(r for r in api.app.routes if getattr(r, "path", "") == "/recommend")
+    docs = api.catalog.docs
+    rng = np.random.default_rng(0)
+    api.catalog_rows(api.catalog)
+
+    async def pydantic_path(ranked):
+        return await serialize_response(
+            field=route.response_field,
+            response_content=api.build_assessments(docs, ranked),
+            is_coroutine=False,
+            dump_json=True,
+        )
+
+    results = {}
+    for size in sizes:
+        ids = rng.integers(0, len(docs), size=size)
+        scores = rng.random(size)
+        edge = EDGE_SCORES[:size]
+        scores[: len(edge)] = edge
+        ranked = [(int(i), float(s)) for i, s in zip(ids, scores)]
+        old = asyncio.run(pydantic_path(ranked))
+        new = api.render_assessments(api.catalog, ranked).body
+        if old != new:
+            raise SystemExit(f"serialization paths disagree for {size} results")
+
+        async def run_pydantic():
+            for _ in range(iterations):
+                await pydantic_path(ranked)
+
+        start = time.perf_counter()
+        asyncio.run(run_pydantic())
+        pydantic_us = (time.perf_counter() - start) / iterations * 1e6
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            api.render_assessments(api.catalog, ranked)
+        fast_us = (time.perf_counter() - start) / iterations * 1e6
+
+        results[str(size)] = {"pydantic_us": pydantic_us, "fast_us": fast_us}
+    return results
+
+
+# ------------------------------
+# Baseline comparison
+# ------------------------------
+def compare(current, baseline, tolerance):
+    """Return a list of human-readable regressions beyond the tolerance."""
+    regressions = []
+
+    base_levels = {lvl["concurrency"]: lvl for lvl in baseline.get("levels", [])}
+    for lvl in current.get("levels", []):
+        base = base_levels.get(lvl["concurrency"])
+        if base is None:
+            continue
+        c = lvl["concurrency"]
+        p95, base_p95 = lvl["latency_ms"]["p95"], base["latency_ms"]["p95"]
+        if p95 is not None and base_p95 and p95 > base_p95 * (1 + tolerance):
+            regressions.append(f"c={c}: p95 {p95:.1f}ms vs baseline {base_p95:.1f}ms")
+        if base["rps"] and lvl["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(
+                f"c={c}: {lvl['rps']:.1f} req/s vs baseline {base['rps']:.1f} req/s"
+            )
+
+    base_stages = baseline.get("stages_ms", {})
+    for stage, stats in current.get("stages_ms", {}).items():
+        base_p50 = base_stages.get(stage, {}).get("p50")
+        if base_p50 and stats["p50"] > base_p50 * (1 + tolerance):
+            regressions.append(
+                f"stage {stage}: p50 {stats['p50']:.2f}ms vs baseline {base_p50:.2f}ms"
+            )
+
+    return regressions
+
+
+def print_report(results):
+    print(f"\nCatalog rows: {results['meta']['catalog_size']}")
+    print(f"{'conc':>5} {'req/s':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'err':>5}")
+    for lvl in results["levels"]:
+        lat = lvl["latency_ms"]
+        print(
+            f"{lvl['concurrency']:>5} {lvl['rps']:>9.1f} "
+            f"{lat['p50'] or 0:>9.1f} {lat['p95'] or 0:>9.1f} {lat['p99'] or 0:>9.1f} "
+            f"{lvl['errors']:>5}"
+        )
+
+    if results.get("stages_ms"):
+        print(f"\n{'stage':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for stage, stats in results["stages_ms"].items():
+            print(
+                f"{stage:>10} {stats['p50']:>9.3f} {stats['p95']:>9.3f} {stats['p99']:>9.3f}"
+            )
+
+    if results.get("serialization_us"):
+        print(f"\n{'results':>8} {'pydantic us':>12} {'fast us':>9} {'speed-up':>9}")
+        for size, cost in results["serialization_us"].items():
+            print(
+                f"{size:>8} {cost['pydantic_us']:>12.1f} {cost['fast_us']:>9.1f} "
+                f"{cost['pydantic_us'] / cost['fast_us']:>8.1f}x"
+            )
+
+    if results.get("instrumentation_us") is not None:
+        print(f"\nMetrics overhead: {results['instrumentation_us']:.1f} us/request")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queries", default="benchmark_queries.txt")
+    parser.add_argument(
+        "--url", help="Benchmark an already running server instead of starting one"
+    )
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per level")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--stage-repeats", type=int, default=3)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--min-score", type=float, default=0.0)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="Compare against a stored results file")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    # Read the baseline before anything is written, and never overwrite it
+    # with the run it is meant to be compared against
+    baseline = None
+    if args.baseline:
+        if os.path.abspath(args.baseline) == os.path.abspath(args.output):
+            sys.exit("--output and --baseline must be different files")
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    # Keep benchmark traffic out of the popular-query log used for warm-up
+    os.environ.setdefault("SHL_QUERY_LOG", "")
+    import api
+
+    queries = load_queries(args.queries)
+    levels = [int(c) for c in args.concurrency.split(",") if c]
+
+    server = None
+    base_url = args.url
+    if base_url is None:
+        port = free_port()
+        server, thread = start_server(api.app, port)
+        base_url = f"http://127.0.0.1:{port}"
+
+    try:
+        run_level(base_url, queries, 1, args.warmup, args.top_k, args.min_score)
+        level_results = [
+            run_level(base_url, queries, c, args.requests, args.top_k, args.min_score)
+            for c in levels
+        ]
+    finally:
+        if server is not None:
+            server.should_exit = True
+            thread.join(timeout=10)
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "catalog_size": len(api.catalog.docs),
+            "queries": len(queries),
+            "top_k": args.top_k,
+            "min_score": args.min_score,
+        },
+        "levels": level_results,
+        "stages_ms": time_stages(
+            api, queries, args.stage_repeats, args.top_k, args.min_score
+        ),
+        "serialization_us": serialization_cost(api),
+        "instrumentation_us": instrumentation_overhead(),
+    }
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print_report(results)
+    print(f"\nSaved results to {args.output}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\nRegressions vs baseline:")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print("\nNo regressions vs baseline.")
+
+
+if __name__ == "__main__":
+    main()
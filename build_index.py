@@ -0,0 +1,95 @@
+"""Precompute the catalog index used by the API and the Streamlit app.
+
+Writes <catalog>.index.npz next to the catalog JSON, tagged with the
+catalog's content hash so a stale index is ignored (and rebuilt in memory)
+after the catalog changes:
+
+    python build_index.py
+    python build_index.py --catalog shl_embeddings_cleaned.json --neighbors 16
+"""
+
+import argparse
+import time
+
+from engine import (
+    CATALOG_PATH,
+    FIELDS,
+    GRAPH_BLOCK_BYTES,
+    GRAPH_K,
+    PCA_DIMS,
+    build_coarse_index,
+    build_neighbor_graph,
+    catalog_version,
+    group_ids,
+    encode_fields,
+    index_path_for,
+    load_catalog,
+    load_model,
+    save_index,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--catalog", default=CATALOG_PATH)
+    parser.add_argument("--output", help="Default: <catalog>.index.npz")
+    parser.add_argument("--neighbors", type=int, default=GRAPH_K)
+    parser.add_argument(
+        "--block-mb",
+        type=int,
+        default=GRAPH_BLOCK_BYTES // (1024 * 1024),
+        help="Memory for one block of scores plus its partition indices",
+    )
+    parser.add_argument(
+        "--pca-dims",
+        type=int,
+        default=PCA_DIMS,
+        help="Dimensions of the coarse two-stage index (0 = skip)",
+    )
+    parser.add_argument(
+        "--no-fields",
+        action="store_true",
+        help="Skip the per-field vectors (no model download needed)",
+    )
+    args = parser.parse_args()
+
+    docs, embeddings = load_catalog(args.catalog)
+    version = catalog_version(args.catalog)
+    output = args.output or index_path_for(args.catalog)
+    index = {}
+
+    start = time.perf_counter()
+    index["neighbors"], index["neighbor_scores"] = build_neighbor_graph(
+        embeddings,
+        group_ids(docs),
+        k=args.neighbors,
+        block_bytes=args.block_mb * 1024 * 1024,
+    )
+    print(
+        f"Neighbour graph: {len(docs)} rows x {index['neighbors'].shape[1]} "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+
+    if not args.no_fields:
+        start = time.perf_counter()
+        index["fields"] = encode_fields(load_model(), docs)
+        print(
+            f"Field vectors: {index['fields'].shape} ({', '.join(FIELDS)}) "
+            f"in {time.perf_counter() - start:.1f}s"
+        )
+
+    if args.pca_dims:
+        start = time.perf_counter()
+        index.update(build_coarse_index(embeddings, args.pca_dims))
+        print(
+            f"Coarse index: {index['coarse'].shape}, "
+            f"{float(index['pca_explained']):.1%} of variance kept, "
+            f"in {time.perf_counter() - start:.1f}s"
+        )
+
+    save_index(output, version, index)
+    print(f"Saved index for catalog {version} to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+"""Bulk offline scoring: the batch version of New_QA.py.
+
+Streams queries from a CSV or JSONL file, encodes them in large batches,
+scores each batch against the catalog with blocked matrix multiplies and
+streams the top matches to JSONL or Parquet. Progress is checkpointed after
+every batch, so re-running the same command resumes an interrupted run.
+
+    python bulk_score.py requisitions.csv --query-column description \\
+        --id-column req_id --output scores.jsonl --workers 4
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from engine import CATALOG_PATH, load_catalog, load_model
+
+OUTPUT_FIELDS = [
+    "name",
+    "url",
+    "duration",
+    "test_type",
+    "remote_testing",
+    "adaptive_irt",
+]
+
+
+# ------------------------------
+# Input
+# ------------------------------
+def read_queries(path, query_column, id_column=None):
+    """Yield (row_id, query) pairs one line at a time."""
+    is_jsonl = path.endswith((".jsonl", ".ndjson"))
+
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        rows = (
+            (json.loads(line) for line in f if line.strip())
+            if is_jsonl
+            else csv.DictReader(f)
+        )
+        for i, row in enumerate(rows):
+            row_id = row[id_column] if id_column else i
+            yield row_id, str(row.get(query_column) or "")
+
+
+def chunked(iterable, size):
+    it = iter(iterable)
+    while True:
+        batch = list(itertools.islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+# ------------------------------
+# Catalog
+# ------------------------------
+def prepare_catalog(docs, embeddings):
+    """Normalize and reorder rows so duplicate (name, url) rows are contiguous.
+
+    Returns (embeddings, group_starts, group_docs): row range
+    group_starts[g]:group_starts[g + 1] holds every copy of group_docs[g].
+    """
+    groups = {}
+    for i, doc in enumerate(docs):
+        groups.setdefault((doc["name"], doc["url"]), []).append(i)
+
+    order = np.fromiter(itertools.chain.from_iterable(groups.values()), dtype=np.int64)
+    sizes = np.array([len(rows) for rows in groups.values()], dtype=np.int64)
+    group_starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    group_docs = [docs[rows[0]] for rows in groups.values()]
+
+    emb = embeddings[order].astype(np.float32)
+    emb /= np.linalg.norm(emb, axis=1, keepdims=True).clip(min=1e-12)
+    return np.ascontiguousarray(emb), group_starts, group_docs
+
+
+def blocked_top_k(query_emb, emb, group_starts, top_k, block_rows):
+    """Top-k unique groups per query, scanning the catalog block by block.
+
+    Only a (batch x block_rows) score matrix is alive at any time; blocks are
+    cut on group boundaries so a group's max score is exact.
+    """
+    n_queries = len(query_emb)
+    n_groups = len(group_starts)
+    bounds = np.append(group_starts, len(emb))
+
+    best_scores = np.empty((n_queries, 0), dtype=np.float32)
+    best_ids = np.empty((n_queries, 0), dtype=np.int64)
+
+    g = 0
+    while g < n_groups:
+        g_end = int(np.searchsorted(group_starts, group_starts[g] + block_rows))
+        g_end = min(max(g_end, g + 1), n_groups)
+        r0, r1 = bounds[g], bounds[g_end]
+
+        block = query_emb @ emb[r0:r1].T
+        group_scores = np.maximum.reduceat(block, group_starts[g:g_end] - r0, axis=1)
+        group_ids = np.broadcast_to(np.arange(g, g_end), group_scores.shape)
+
+        cand_scores = np.concatenate([best_scores, group_scores], axis=1)
+        cand_ids = np.concatenate([best_ids, group_ids], axis=1)
+        if cand_scores.shape[1] > top_k:
+            keep = np.argpartition(-cand_scores, top_k - 1, axis=1)[:, :top_k]
+            cand_scores = np.take_along_axis(cand_scores, keep, axis=1)
+            cand_ids = np.take_along_axis(cand_ids, keep, axis=1)
+        best_scores, best_ids = cand_scores, cand_ids
+        g = g_end
+
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    return np.take_along_axis(best_scores, order, 1), np.take_along_axis(
+        best_ids, order, 1
+    )
+
+
+# ------------------------------
+# Scoring (runs in-process or in pool workers)
+# ------------------------------
+_state = {}
+
+
+def init_worker(catalog_path, top_k, min_score, block_rows, encode_batch_size, threads):
+    if threads:
+        import torch
+
+        torch.set_num_threads(threads)
+    docs, embeddings = load_catalog(catalog_path)
+    emb, group_starts, group_docs = prepare_catalog(docs, embeddings)
+    _state.update(
+        model=load_model(),
+        emb=emb,
+        group_starts=group_starts,
+        group_docs=group_docs,
+        top_k=min(top_k, len(group_docs)),
+        min_score=min_score,
+        block_rows=block_rows,
+        encode_batch_size=encode_batch_size,
+    )
+
+
+def score_batch(batch):
+    """Return flat result records for a list of (row_id, query) pairs."""
+    query_emb = (
+        _state["model"]
+        .encode(
+            [query for _, query in batch],
+            batch_size=_state["encode_batch_size"],
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+        )
+        .astype(np.float32)
+    )
+
+    scores, ids = blocked_top_k(
+        query_emb,
+        _state["emb"],
+        _state["group_starts"],
+        _state["top_k"],
+        _state["block_rows"],
+    )
+
+    records = []
+    for (row_id, _), row_scores, row_ids in zip(batch, scores, ids):
+        for rank, (score, gid) in enumerate(zip(row_scores, row_ids), start=1):
+            if _state["min_score"] is not None and score < _state["min_score"]:
+                break
+            doc = _state["group_docs"][gid]
+            record = {"id": row_id, "rank": rank, "score": float(score)}
+            record.update({field: doc.get(field, "") for field in OUTPUT_FIELDS})
+            records.append(record)
+    return records
+
+
+def score_batches(batches, workers, init_args):
+    """Yield (batch, records) in input order, keeping a bounded queue in flight."""
+    if workers <= 1:
+        init_worker(*init_args)
+        for batch in batches:
+            yield batch, score_batch(batch)
+        return
+
+    with ProcessPoolExecutor(
+        workers, initializer=init_worker, initargs=init_args
+    ) as pool:
+        pending = deque()
+        for batch in batches:
+            pending.append((batch, pool.submit(score_batch, batch)))
+            if len(pending) >= workers * 2:
+                batch, future = pending.popleft()
+                yield batch, future.result()
+        while pending:
+            batch, future = pending.popleft()
+            yield batch, future.result()
+
+
+# ------------------------------
+# Output + checkpointing
+# ------------------------------
+class JsonlWriter:
+    def __init__(self, path, state):
+        resume_bytes = state["output_bytes"]
+        if resume_bytes:
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if size < resume_bytes:
+                sys.exit(
+                    f"{path} is shorter than its checkpoint ({size} < {resume_bytes} "
+                    "bytes); delete the checkpoint or use --restart to start over"
+                )
+        self.f = open(path, "ab" if resume_bytes else "wb")
+        # Drop anything written after the last checkpoint
+        self.f.truncate(resume_bytes)
+        self.f.seek(resume_bytes)
+
+    def write(self, records, first_row):
+        for record in records:
+            self.f.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        return self.f.tell()
+
+    def close(self):
+        self.f.close()
+
+
+class ParquetWriter:
+    """One part file per batch, written atomically, in an output directory."""
+
+    def __init__(self, path, state):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            sys.exit("Parquet output needs pyarrow: pip install pyarrow")
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+        # Drop parts from batches that were never checkpointed
+        for name in os.listdir(path):
+            if name.startswith("part-"):
+                first_row = int(name.split("-")[1].split(".")[0])
+                if first_row >= state["rows_done"]:
+                    os.remove(os.path.join(path, name))
+
+    def write(self, records, first_row):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        part = os.path.join(self.path, f"part-{first_row:012d}.parquet")
+        tmp = part + ".tmp"
+        pq.write_table(pa.Table.from_pylist(records), tmp)
+        os.replace(tmp, part)
+        return 0
+
+    def close(self):
+        pass
+
+
+def load_checkpoint(path, fingerprint):
+    if not os.path.exists(path):
+        return {"rows_done": 0, "output_bytes": 0, "fingerprint": fingerprint}
+    with open(path, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    if state["fingerprint"] != fingerprint:
+        sys.exit(
+            f"{path} was written with different arguments; "
+            "delete it or use --restart to start over"
+        )
+    return state
+
+
+def save_checkpoint(path, state):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="CSV or JSONL file of queries")
+    parser.add_argument("--query-column", default="query")
+    parser.add_argument(
+        "--id-column", help="Column to copy as 'id' (default: row number)"
+    )
+    parser.add_argument(
+        "--output", required=True, help="*.jsonl file or *.parquet directory"
+    )
+    parser.add_argument("--catalog", default=CATALOG_PATH)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--min-score", type=float, default=None)
+    parser.add_argument(
+        "--batch-size", type=int, default=2048, help="Queries per batch"
+    )
+    parser.add_argument("--encode-batch-size", type=int, default=128)
+    parser.add_argument(
+        "--block-rows", type=int, default=8192, help="Catalog rows per matmul"
+    )
+    parser.add_argument("--workers", type=int, default=1, help="Scoring processes")
+    parser.add_argument("--restart", action="store_true", help="Ignore any checkpoint")
+    args = parser.parse_args()
+
+    checkpoint_path = args.output.rstrip("/") + ".progress"
+    fingerprint = {
+        "input": os.path.abspath(args.input),
+        "query_column": args.query_column,
+        "id_column": args.id_column,
+        "catalog": os.path.abspath(args.catalog),
+        "top_k": args.top_k,
+        "min_score": args.min_score,
+        "batch_size": args.batch_size,
+    }
+    if args.restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    state = load_checkpoint(checkpoint_path, fingerprint)
+    if state["rows_done"]:
+        print(f"Resuming after {state['rows_done']} rows")
+
+    writer_cls = (
+        ParquetWriter if args.output.rstrip("/").endswith(".parquet") else JsonlWriter
+    )
+    writer = writer_cls(args.output, state)
+
+    threads = max(1, (os.cpu_count() or 1) // args.workers) if args.workers > 1 else 0
+    init_args = (
+        args.catalog,
+        args.top_k,
+        args.min_score,
+        args.block_rows,
+        args.encode_batch_size,
+        threads,
+    )
+
+    rows = itertools.islice(
+        read_queries(args.input, args.query_column, args.id_column),
+        state["rows_done"],
+        None,
+    )
+    start = time.perf_counter()
+    processed = 0
+
+    try:
+        for batch, records in score_batches(
+            chunked(rows, args.batch_size), args.workers, init_args
+        ):
+            state["output_bytes"] = writer.write(records, state["rows_done"])
+            state["rows_done"] += len(batch)
+            save_checkpoint(checkpoint_path, state)
+
+            processed += len(batch)
+            elapsed = time.perf_counter() - start
+            print(
+                f"{state['rows_done']} rows done | {processed / elapsed:.1f} rows/s",
+                flush=True,
+            )
+    except KeyboardInterrupt:
+        print(f"\nInterrupted after {state['rows_done']} rows; re-run to resume.")
+        sys.exit(130)
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    rate = processed / elapsed if elapsed > 0 else 0.0
+    print(
+        f"Scored {processed} rows in {elapsed:.1f}s ({rate:.1f} rows/s) -> {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,605 @@
+import hashlib
+import json
+import logging
+import os
+import heapq
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import numpy as np
+from sentence_transformers import SentenceTransformer, util
+
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+CATALOG_PATH = "shl_embeddings_cleaned.json"
+
+# Neighbours stored per assessment; a few more than the API's top_k limit so
+# duplicate rows can be skipped at serve time
+GRAPH_K = 16
+# Upper bound on the (rows x catalog) score block held while building the graph
+GRAPH_BLOCK_BYTES = 256 * 1024 * 1024
+
+# Separately embedded text fields per assessment, in index order
+FIELDS = ("name", "description", "levels")
+
+# Two-stage search: scan a PCA projection of the catalog, then re-score the
+# best COARSE_SHORTLIST rows against the full vectors. Only worth it (and only
+# used) on catalogs of at least TWO_STAGE_MIN_ROWS rows.
+PCA_DIMS = 128
+TWO_STAGE_MIN_ROWS = int(os.environ.get("SHL_TWO_STAGE_MIN_ROWS", "50000"))
+COARSE_SHORTLIST = int(os.environ.get("SHL_COARSE_SHORTLIST", "256"))
+
+# Scatter-gather: split the scanned matrix into SHARDS row ranges scored on
+# a thread pool (NumPy releases the GIL in the matrix product and the
+# partition), then heap-merge the per-shard top SHARD_DEPTH lists. Only used
+# on catalogs of at least SHARD_MIN_ROWS rows, where the scan dominates.
+SHARDS = int(os.environ.get("SHL_SHARDS", "1"))
+SHARD_MIN_ROWS = int(os.environ.get("SHL_SHARD_MIN_ROWS", "20000"))
+# Candidates kept per shard: well above the API's top_k so duplicate rows
+# can still be skipped when ranking
+SHARD_DEPTH = 64
+
+# Everything derived from one catalog file, swapped as a unit on reload.
+# `index` holds the arrays precomputed by build_index.py, `lookup` maps URL
+# slugs and lower-cased names to row numbers.
+Catalog = namedtuple("Catalog", ["docs", "embeddings", "version", "index", "lookup"])
+
+logger = logging.getLogger("shl.engine")
+
+
+# ------------------------------
+# Loading
+# ------------------------------
+def load_model():
+    return SentenceTransformer(MODEL_NAME)
+
+
+def load_catalog(path=CATALOG_PATH):
+    """Load catalog rows and stack their embeddings into one float32 matrix."""
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+
+    docs = []
+    embeddings = []
+    for entry in raw:
+        docs.append(entry)
+        embeddings.append(np.array(entry["embedding"], dtype=np.float32))
+
+    return docs, np.stack(embeddings)
+
+
+def catalog_version(path=CATALOG_PATH):
+    """Short content hash of the catalog file, used to tag metrics and caches."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def index_path_for(path):
+    return os.path.splitext(path)[0] + ".index.npz"
+
+
+def open_catalog(path=CATALOG_PATH, model=None, field_weights=None):
+    """Load a catalog and its precomputed index, rebuilding the index if stale.
+
+    Missing field vectors are only encoded when field weights will use them,
+    and only when a model is passed in.
+    """
+    docs, embeddings = load_catalog(path)
+    version = catalog_version(path)
+    if field_weights is None:
+        model = None
+
+    index = load_index(index_path_for(path), version)
+    if index is None:
+        logger.warning(
+            "no up-to-date index for %s; building it in memory "
+            "(run build_index.py to precompute it)",
+            path,
+        )
+        index = build_index(docs, embeddings, model)
+    elif "fields" not in index and model is not None:
+        index["fields"] = encode_fields(model, docs)
+
+    return Catalog(docs, embeddings, version, index, build_lookup(docs))
+
+
+def assessment_slug(doc):
+    return doc["url"].rstrip("/").rsplit("/", 1)[-1]
+
+
+def build_lookup(docs):
+    lookup = {}
+    for i, doc in enumerate(docs):
+        lookup.setdefault(doc["name"].lower(), i)
+        lookup.setdefault(assessment_slug(doc), i)
+    return lookup
+
+
+def find_assessment(catalog, key):
+    """Row number for a URL slug or (case-insensitive) name, or None."""
+    idx = catalog.lookup.get(key)
+    if idx is None:
+        idx = catalog.lookup.get(key.strip().lower())
+    return idx
+
+
+# ------------------------------
+# Precomputed index
+# ------------------------------
+def unit_rows(x):
+    return x / np.linalg.norm(x, axis=1, keepdims=True).clip(min=1e-12)
+
+
+def group_ids(docs):
+    """Integer id per row; rows sharing (name, url) share an id."""
+    ids = {}
+    return np.array(
+        [ids.setdefault((doc["name"], doc["url"]), len(ids)) for doc in docs],
+        dtype=np.int64,
+    )
+
+
+def same_group_pairs(groups):
+    """(rows, cols) of every pair of rows sharing a group id, including (i, i)."""
+    order = np.argsort(groups, kind="stable")
+    bounds = np.flatnonzero(np.diff(groups[order])) + 1
+    rows, cols = [], []
+    for members in np.split(order, bounds):
+        rows.append(np.repeat(members, len(members)))
+        cols.append(np.tile(members, len(members)))
+    return np.concatenate(rows), np.concatenate(cols)
+
+
+# Bytes held per (row, catalog row) element of a graph block: the float32
+# scores plus the int64 index array argpartition returns
+GRAPH_BYTES_PER_ELEMENT = 4 + 8
+
+
+def build_neighbor_graph(embeddings, groups, k=GRAPH_K, block_bytes=GRAPH_BLOCK_BYTES):
+    """Top-k most similar rows for every row, as int32 ids and float16 scores.
+
+    Scores are computed a block of rows at a time; the block and the
+    argpartition indices over it stay within `block_bytes` whatever the
+    catalog size. Rows with the same (name, url) are never each other's
+    neighbours.
+    """
+    n = len(embeddings)
+    k = min(k, n - 1)
+    unit = unit_rows(embeddings)
+    block_rows = max(1, block_bytes // (GRAPH_BYTES_PER_ELEMENT * n))
+
+    neighbors = np.empty((n, k), dtype=np.int32)
+    scores = np.empty((n, k), dtype=np.float16)
+    if k <= 0:
+        return neighbors, scores
+
+    pair_rows, pair_cols = same_group_pairs(groups)
+    for r0 in range(0, n, block_rows):
+        r1 = min(n, r0 + block_rows)
+        # Negated in place so argpartition's smallest are the most similar,
+        # without a second (block_rows x n) array
+        block = unit[r0:r1] @ unit.T
+        np.negative(block, out=block)
+        in_block = (pair_rows >= r0) & (pair_rows < r1)
+        block[pair_rows[in_block] - r0, pair_cols[in_block]] = np.inf
+
+        # Copied so the full (block_rows x n) index array is freed right away
+        top = np.argpartition(block, k - 1, axis=1)[:, :k].copy()
+        top_scores = np.take_along_axis(block, top, axis=1)
+        del block
+        order = np.argsort(top_scores, axis=1)
+        neighbors[r0:r1] = np.take_along_axis(top, order, axis=1)
+        scores[r0:r1] = -np.take_along_axis(top_scores, order, axis=1)
+
+    return neighbors, scores
+
+
+def field_texts(doc):
+    levels = " ".join(
+        part.strip()
+        for part in f"{doc.get('job_levels', '')},{doc.get('languages', '')}".split(",")
+        if part.strip()
+    )
+    return (doc["name"], doc.get("description", ""), levels)
+
+
+def encode_fields(model, docs, batch_size=64):
+    """Unit vectors per (row, field) as one contiguous (rows, fields, dim) array.
+
+    Empty fields get a zero vector so they add nothing to the weighted score.
+    """
+    texts = [field_texts(doc) for doc in docs]
+    columns = []
+    for f in range(len(FIELDS)):
+        column = [row[f] for row in texts]
+        vectors = model.encode(
+            column,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+        ).astype(np.float32)
+        vectors[[not text for text in column]] = 0.0
+        columns.append(vectors)
+    return np.ascontiguousarray(np.stack(columns, axis=1))
+
+
+def fit_pca(embeddings, dims=PCA_DIMS, block_rows=65536):
+    """Mean, (dim x dims) principal axes and explained variance ratio of the
+    unit-length embeddings, accumulated block by block."""
+    n, d = embeddings.shape
+    dims = min(dims, d)
+
+    total = np.zeros(d, dtype=np.float64)
+    for r0 in range(0, n, block_rows):
+        total += unit_rows(embeddings[r0 : r0 + block_rows]).sum(axis=0)
+    mean = total / n
+
+    cov = np.zeros((d, d), dtype=np.float64)
+    for r0 in range(0, n, block_rows):
+        centered = unit_rows(embeddings[r0 : r0 + block_rows]) - mean
+        cov += centered.T @ centered
+
+    eigvals, eigvecs = np.linalg.eigh(cov / n)
+    order = np.argsort(eigvals)[::-1][:dims]
+    explained = float(eigvals[order].sum() / max(eigvals.sum(), 1e-12))
+    components = np.ascontiguousarray(eigvecs[:, order], dtype=np.float32)
+    return mean.astype(np.float32), components, explained
+
+
+def project(embeddings, mean, components, block_rows=65536):
+    """Coarse (rows x dims) coordinates of the unit embeddings."""
+    out = np.empty((len(embeddings), components.shape[1]), dtype=np.float32)
+    for r0 in range(0, len(embeddings), block_rows):
+        block = unit_rows(embeddings[r0 : r0 + block_rows]) - mean
+        out[r0 : r0 + block_rows] = block @ components
+    return out
+
+
+def build_coarse_index(embeddings, dims=PCA_DIMS):
+    mean, components, explained = fit_pca(embeddings, dims)
+    return {
+        "pca_mean": mean,
+        "pca_components": components,
+        "pca_explained": np.float32(explained),
+        "coarse": project(embeddings, mean, components),
+    }
+
+
+def build_index(docs, embeddings, model=None):
+    """Everything build_index.py precomputes; field vectors need the model."""
+    neighbors, neighbor_scores = build_neighbor_graph(embeddings, group_ids(docs))
+    index = {"neighbors": neighbors, "neighbor_scores": neighbor_scores}
+    if model is not None:
+        index["fields"] = encode_fields(model, docs)
+    if len(docs) >= TWO_STAGE_MIN_ROWS:
+        index.update(build_coarse_index(embeddings))
+    return index
+
+
+def save_index(path, version, index):
+    np.savez(path, version=np.array(version), **index)
+
+
+def load_index(path, version):
+    """Arrays from an index file, or None if missing or built for another catalog."""
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as f:
+        if str(f["version"]) != version:
+            return None
+        return {name: f[name] for name in f.files if name != "version"}
+
+
+# ------------------------------
+# Caching
+# ------------------------------
+def normalize_query(query):
+    # all-MiniLM-L6-v2 is uncased, so case and whitespace do not change the embedding
+    return " ".join(query.split()).lower()
+
+
+class LRUCache:
+    """Small thread-safe LRU map that counts its own hits and misses."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def peek(self, key):
+        """Look up without touching recency or the hit/miss counters."""
+        with self._lock:
+            return self._data.get(key)
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self):
+        return len(self._data)
+
+
+# ------------------------------
+# Search stages
+# ------------------------------
+def encode_query(model, query):
+    return model.encode(query, convert_to_tensor=True)
+
+
+def count_tokens(model, text):
+    """Token count before truncation to the model's max_seq_length."""
+    return len(model.tokenizer(text, add_special_tokens=True)["input_ids"])
+
+
+def score_query(query_embedding, embeddings):
+    return util.cos_sim(query_embedding, embeddings)[0].cpu().numpy()
+
+
+def parse_field_weights(spec):
+    """ "name=0.5,description=0.3,levels=0.2" -> weights in FIELDS order, or None."""
+    if not spec or not spec.strip():
+        return None
+    weights = dict.fromkeys(FIELDS, 0.0)
+    for part in spec.split(","):
+        field, _, value = part.partition("=")
+        field = field.strip()
+        if field not in weights:
+            raise ValueError(f"unknown field {field!r}; expected one of {FIELDS}")
+        weights[field] = float(value)
+    return tuple(weights[field] for field in FIELDS)
+
+
+_field_matrices = {}
+_field_lock = threading.Lock()
+_warned_no_fields = set()
+
+
+def field_matrix(catalog, weights):
+    """sum_f weights[f] * fields[:, f, :], cached per (catalog version, weights).
+
+    Field vectors are unit length, so a dot product with the unit query
+    against this matrix is exactly the weighted sum of per-field cosines,
+    i.e. one (rows x dim) product per query however many fields there are.
+    """
+    key = (catalog.version, weights)
+    with _field_lock:
+        matrix = _field_matrices.get(key)
+        if matrix is None:
+            fields = catalog.index["fields"]
+            matrix = np.einsum("rfd,f->rd", fields, np.asarray(weights, np.float32))
+            matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+            # Only the live catalog (and one being warmed for reload) matter
+            if len(_field_matrices) >= 4:
+                _field_matrices.clear()
+            _field_matrices[key] = matrix
+    return matrix
+
+
+def unit_matrix(catalog):
+    """Row-normalized embeddings, cached per catalog version like field_matrix."""
+    key = (catalog.version, None)
+    with _field_lock:
+        matrix = _field_matrices.get(key)
+        if matrix is None:
+            matrix = np.ascontiguousarray(unit_rows(catalog.embeddings), np.float32)
+            if len(_field_matrices) >= 4:
+                _field_matrices.clear()
+            _field_matrices[key] = matrix
+    return matrix
+
+
+_shard_pool = None
+_shard_pool_size = 0
+_shard_pool_lock = threading.Lock()
+
+
+def shard_pool(shards):
+    """Shared scan threads, grown (never shrunk) to at least `shards`."""
+    global _shard_pool, _shard_pool_size
+    with _shard_pool_lock:
+        if _shard_pool_size < shards:
+            # The old pool is not shut down: a scan may still be submitting to
+            # it; its idle threads exit once it is garbage collected
+            _shard_pool = ThreadPoolExecutor(shards, thread_name_prefix="shard")
+            _shard_pool_size = shards
+        return _shard_pool
+
+
+def shard_bounds(n, shards):
+    """[start, stop) row ranges of (nearly) equal size."""
+    edges = np.linspace(0, n, shards + 1).astype(np.int64)
+    return [(int(a), int(b)) for a, b in zip(edges[:-1], edges[1:]) if b > a]
+
+
+def shard_top_k(matrix, query, start, stop, k):
+    """Best k rows of matrix[start:stop] by dot product, as sorted (-score, id)."""
+    scores = matrix[start:stop] @ query
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return list(zip((-scores[top]).tolist(), (top + start).tolist()))
+
+
+def sharded_top_k(matrix, query, k, shards=SHARDS):
+    """(row ids, scores) of the k best rows, scanning `shards` row ranges in parallel.
+
+    Each shard returns its own sorted top k; heapq.merge interleaves the
+    sorted lists and the first k merged entries are the global top k.
+    """
+    bounds = shard_bounds(len(matrix), max(1, shards))
+    if len(bounds) == 1:
+        parts = [shard_top_k(matrix, query, 0, len(matrix), k)]
+    else:
+        pool = shard_pool(len(bounds))
+        futures = [
+            pool.submit(shard_top_k, matrix, query, start, stop, k)
+            for start, stop in bounds
+        ]
+        parts = [future.result() for future in futures]
+
+    merged = list(islice(heapq.merge(*parts), k))
+    ids = np.fromiter((idx for _, idx in merged), dtype=np.int64, count=len(merged))
+    scores = np.fromiter(
+        (-neg for neg, _ in merged), dtype=np.float32, count=len(merged)
+    )
+    return ids, scores
+
+
+def use_fields(catalog, field_weights):
+    """Whether field weights apply to this catalog (warns once if they cannot)."""
+    if field_weights is None:
+        return False
+    if "fields" not in catalog.index:
+        if catalog.version not in _warned_no_fields:
+            _warned_no_fields.add(catalog.version)
+            logger.warning("catalog index has no field vectors; using embeddings")
+        return False
+    return True
+
+
+def score_catalog(query_embedding, catalog, field_weights=None):
+    """Cosine scores against the catalog, field-weighted when weights are given."""
+    if not use_fields(catalog, field_weights):
+        return score_query(query_embedding, catalog.embeddings)
+
+    return field_matrix(catalog, field_weights) @ unit_query(query_embedding)
+
+
+def unit_query(query_embedding):
+    query = query_embedding.cpu().numpy().astype(np.float32).reshape(-1)
+    return query / max(float(np.linalg.norm(query)), 1e-12)
+
+
+def score_candidates(
+    query_embedding, catalog, field_weights=None, shortlist=None, shards=None, depth=0
+):
+    """Scores to rank: (None, a score per row) or (row ids, their scores).
+
+    On catalogs with a coarse index and at least TWO_STAGE_MIN_ROWS rows (or
+    whenever `shortlist` is given), every row is first scored in the reduced
+    PCA space and only the best `shortlist` rows are re-scored against the
+    full vectors. On catalogs of at least SHARD_MIN_ROWS rows (or whenever
+    `shards` is given) the scan is split across SHARDS threads and only the
+    best max(SHARD_DEPTH, depth) rows come back; callers ranking more than
+    SHARD_DEPTH results must pass `depth`.
+    """
+    index = catalog.index
+    n = len(catalog.docs)
+    if shortlist is None:
+        shortlist = COARSE_SHORTLIST if n >= TWO_STAGE_MIN_ROWS else 0
+    if shards is None:
+        shards = SHARDS if n >= SHARD_MIN_ROWS else 1
+    two_stage = shortlist and shortlist < n and "coarse" in index
+
+    if not two_stage and shards <= 1:
+        return None, score_catalog(query_embedding, catalog, field_weights)
+
+    query = unit_query(query_embedding)
+    if use_fields(catalog, field_weights):
+        matrix = field_matrix(catalog, field_weights)
+    elif two_stage:
+        matrix = None
+    else:
+        matrix = unit_matrix(catalog)
+
+    if not two_stage:
+        return sharded_top_k(matrix, query, max(SHARD_DEPTH, depth), shards)
+
+    # x.q ~= mean.q + (P^T (x - mean)).(P^T q); the first term is the same for
+    # every row, so ranking only needs the second
+    projected = index["pca_components"].T @ query
+    if shards > 1:
+        ids, _ = sharded_top_k(index["coarse"], projected, shortlist, shards)
+    else:
+        coarse = index["coarse"] @ projected
+        ids = np.argpartition(-coarse, shortlist - 1)[:shortlist]
+
+    if matrix is not None:
+        full = matrix[ids]
+    else:
+        full = unit_rows(catalog.embeddings[ids])
+    return ids, full @ query
+
+
+def rank_results(docs, scores, top_k, min_score=None, indices=None, mask=None):
+    """Return (index, score) pairs for the top_k unique (name, url) rows.
+
+    When `indices` is given, scores[i] belongs to row indices[i]. Rows where
+    the boolean `mask` (one entry per catalog row) is False are skipped.
+    """
+    sorted_positions = scores.argsort()[::-1]
+
+    seen = set()
+    ranked = []
+
+    for pos in sorted_positions:
+        idx = indices[pos] if indices is not None else pos
+        if mask is not None and not mask[idx]:
+            continue
+        doc = docs[idx]
+        name_url = (doc["name"], doc["url"])
+        if name_url in seen:
+            continue
+        seen.add(name_url)
+
+        score = float(scores[pos])
+        if min_score is not None and score < min_score:
+            continue
+
+        ranked.append((int(idx), score))
+
+        if len(ranked) >= top_k:
+            break
+
+    return ranked
+
+
+def similar_results(catalog, idx, top_k):
+    """(index, score) pairs of the precomputed neighbours of row idx."""
+    neighbors = catalog.index["neighbors"][idx]
+    scores = catalog.index["neighbor_scores"][idx]
+
+    seen = {(catalog.docs[idx]["name"], catalog.docs[idx]["url"])}
+    ranked = []
+
+    for j, score in zip(neighbors, scores):
+        if not np.isfinite(score):
+            break
+        doc = catalog.docs[j]
+        name_url = (doc["name"], doc["url"])
+        if name_url in seen:
+            continue
+        seen.add(name_url)
+
+        ranked.append((int(j), float(score)))
+
+        if len(ranked) >= top_k:
+            break
+
+    return ranked
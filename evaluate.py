@@ -0,0 +1,190 @@
+"""Relevance and latency of bi-encoder ranking vs. cross-encoder re-ranking.
+
+Reads an evaluation set (JSONL of {"query": ..., "relevant": [slug, ...]},
+slugs being the last part of the assessment URL) and reports Mean Recall@K
+and MAP@K as defined in the README, plus per-query latency:
+
+    python evaluate.py --eval-set eval_set.jsonl --k 5,10
+    python evaluate.py --budget-ms 1000 --output eval_results.json
+"""
+
+import argparse
+import json
+import os
+import time
+
+from benchmark import summarize
+from engine import (
+    PCA_DIMS,
+    build_coarse_index,
+    encode_query,
+    find_assessment,
+    load_model,
+    open_catalog,
+    parse_field_weights,
+    rank_results,
+    score_candidates,
+)
+from rerank import RERANK_BUDGET_MS, RERANK_MODEL, RERANK_TOP_N, Reranker
+
+
+def load_eval_set(path, catalog):
+    cases = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            case = json.loads(line)
+            relevant = set()
+            for slug in case["relevant"]:
+                idx = find_assessment(catalog, slug)
+                if idx is None:
+                    raise SystemExit(f"unknown assessment in eval set: {slug}")
+                relevant.add(idx)
+            cases.append((case["query"], relevant))
+    return cases
+
+
+def recall_at_k(predicted, relevant, k):
+    return len(set(predicted[:k]) & relevant) / len(relevant)
+
+
+def average_precision_at_k(predicted, relevant, k):
+    hits = 0
+    total = 0.0
+    for rank, idx in enumerate(predicted[:k], start=1):
+        if idx in relevant:
+            hits += 1
+            total += hits / rank
+    return total / min(k, len(relevant))
+
+
+def evaluate(cases, ranker, ks):
+    """Run ranker(query) -> [row ids] over all cases; return metrics and latency."""
+    recalls = {k: [] for k in ks}
+    precisions = {k: [] for k in ks}
+    latencies = []
+
+    for query, relevant in cases:
+        start = time.perf_counter()
+        predicted = ranker(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+        for k in ks:
+            recalls[k].append(recall_at_k(predicted, relevant, k))
+            precisions[k].append(average_precision_at_k(predicted, relevant, k))
+
+    return {
+        "recall": {k: sum(v) / len(v) for k, v in recalls.items()},
+        "map": {k: sum(v) / len(v) for k, v in precisions.items()},
+        "latency_ms": summarize(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--eval-set", default="eval_set.jsonl")
+    parser.add_argument("--k", default="5,10")
+    parser.add_argument("--rerank-model", default=RERANK_MODEL)
+    parser.add_argument("--top-n", type=int, default=RERANK_TOP_N)
+    parser.add_argument("--budget-ms", type=float, default=RERANK_BUDGET_MS)
+    parser.add_argument(
+        "--field-weights",
+        default=os.environ.get("SHL_FIELD_WEIGHTS", ""),
+        help='Bi-encoder field weights, e.g. "name=0.5,description=0.3,levels=0.2"',
+    )
+    parser.add_argument(
+        "--shortlist",
+        type=int,
+        default=None,
+        help="Force two-stage search with this coarse shortlist (0 = full scan)",
+    )
+    parser.add_argument(
+        "--pca-dims",
+        type=int,
+        default=PCA_DIMS,
+        help="Coarse index dimensions when the index has none (small catalogs)",
+    )
+    parser.add_argument("--output", help="Also write the results as JSON")
+    args = parser.parse_args()
+
+    ks = [int(k) for k in args.k.split(",") if k]
+    field_weights = parse_field_weights(args.field_weights)
+    shortlist = args.shortlist
+    depth = max(max(ks), args.top_n)
+
+    model = load_model()
+    catalog = open_catalog(model=model, field_weights=field_weights)
+    cases = load_eval_set(args.eval_set, catalog)
+    if shortlist:
+        n = len(catalog.docs)
+        if shortlist >= n:
+            print(
+                f"warning: --shortlist {shortlist} covers all {n} catalog rows; "
+                "this measures the exact full scan"
+            )
+        elif "coarse" not in catalog.index:
+            # Catalogs below TWO_STAGE_MIN_ROWS are indexed without one
+            print(f"Fitting a {args.pca_dims}-dim coarse index for --shortlist")
+            catalog.index.update(build_coarse_index(catalog.embeddings, args.pca_dims))
+    reranker = Reranker(args.rerank_model, args.top_n, args.budget_ms)
+    reranker.model  # load before timing
+
+    reranked_count = 0
+
+    def bi_encoder(query):
+        indices, scores = score_candidates(
+            encode_query(model, query), catalog, field_weights, shortlist, depth=depth
+        )
+        return rank_results(catalog.docs, scores, depth, indices=indices)
+
+    def bi_encoder_ids(query):
+        return [idx for idx, _ in bi_encoder(query)]
+
+    def with_rerank(query):
+        nonlocal reranked_count
+        start = time.perf_counter()
+        ranked = bi_encoder(query)
+        ranked, reranked = reranker.rerank(
+            query, catalog.docs, ranked, time.perf_counter() - start
+        )
+        reranked_count += reranked
+        return [idx for idx, _ in ranked]
+
+    # One untimed pass so the first query does not pay for lazy initialization
+    bi_encoder(cases[0][0])
+
+    results = {
+        "queries": len(cases),
+        "rerank_model": args.rerank_model,
+        "top_n": args.top_n,
+        "budget_ms": args.budget_ms,
+        "field_weights": args.field_weights,
+        "shortlist": shortlist,
+        "bi_encoder": evaluate(cases, bi_encoder_ids, ks),
+        "rerank": evaluate(cases, with_rerank, ks),
+    }
+    results["rerank"]["reranked_fraction"] = reranked_count / len(cases)
+
+    print(f"{len(cases)} queries, re-ranking top {args.top_n} with {args.rerank_model}")
+    print(
+        f"{'':>12} "
+        + " ".join(f"{'R@' + str(k):>7} {'MAP@' + str(k):>7}" for k in ks)
+        + f" {'p50 ms':>8} {'p95 ms':>8}"
+    )
+    for name in ("bi_encoder", "rerank"):
+        res = results[name]
+        cells = " ".join(f"{res['recall'][k]:>7.3f} {res['map'][k]:>7.3f}" for k in ks)
+        lat = res["latency_ms"]
+        print(f"{name:>12} {cells} {lat['p50']:>8.1f} {lat['p95']:>8.1f}")
+    print(
+        f"Re-ranked within budget: {results['rerank']['reranked_fraction']:.0%} of queries"
+    )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
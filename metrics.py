@@ -0,0 +1,144 @@
+"""Prometheus metrics shared by the API.
+
+Everything lives on the default registry, which also carries the standard
+process collector (process_resident_memory_bytes, cpu seconds, open fds).
+"""
+
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+
+# Search stages are sub-millisecond to tens of milliseconds, so the default
+# buckets (5ms .. 10s) are too coarse at the low end.
+STAGE_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+)
+
+REQUESTS = Counter(
+    "shl_requests_total", "HTTP requests handled", ["endpoint", "status"]
+)
+REQUEST_LATENCY = Histogram(
+    "shl_request_latency_seconds",
+    "End-to-end request latency",
+    ["endpoint"],
+    buckets=STAGE_BUCKETS,
+)
+STAGE_LATENCY = Histogram(
+    "shl_stage_latency_seconds",
+    "Latency of each search stage (encode, score, rank, serialize)",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+ENCODER_BATCH_SIZE = Histogram(
+    "shl_encoder_batch_size",
+    "Number of texts per model.encode call",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512),
+)
+QUEUE_WAIT = Histogram(
+    "shl_queue_wait_seconds",
+    "Time spent waiting for an encoder slot",
+    buckets=STAGE_BUCKETS,
+)
+ENCODER_IN_FLIGHT = Gauge("shl_encoder_in_flight", "model.encode calls running")
+REJECTED = Counter(
+    "shl_rejected_total", "Requests shed by admission control", ["reason"]
+)
+TRUNCATED_QUERIES = Counter(
+    "shl_truncated_queries_total", "Queries cut to SHL_MAX_QUERY_CHARS"
+)
+RERANK_FALLBACKS = Counter(
+    "shl_rerank_fallbacks_total",
+    "Requests served in bi-encoder order instead of re-ranked",
+    ["reason"],
+)
+CACHE_REQUESTS = Counter(
+    "shl_cache_requests_total", "Cache lookups", ["cache", "result"]
+)
+CACHE_HIT_RATIO = Gauge(
+    "shl_cache_hit_ratio", "Lifetime hit ratio of each cache", ["cache"]
+)
+CACHE_ENTRIES = Gauge("shl_cache_entries", "Entries held by each cache", ["cache"])
+CATALOG_SIZE = Gauge("shl_catalog_rows", "Rows in the loaded assessment catalog")
+CATALOG_INFO = Gauge(
+    "shl_catalog_info", "Loaded catalog version (value is always 1)", ["version"]
+)
+
+
+class RequestMetricsMiddleware:
+    """Request count and latency per route template, as plain ASGI middleware.
+
+    @app.middleware("http") (BaseHTTPMiddleware) costs a few hundred
+    microseconds per request; wrapping `send` to catch the status costs a
+    few. Latency runs until the last body chunk is sent, so streamed
+    responses are timed in full.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router fills in the matched route on this same scope
+            route = scope.get("route")
+            endpoint = route.path if route is not None else "unmatched"
+            REQUESTS.labels(endpoint, str(status)).inc()
+            REQUEST_LATENCY.labels(endpoint).observe(time.perf_counter() - start)
+
+
+def observe_stage(stage, seconds):
+    STAGE_LATENCY.labels(stage).observe(seconds)
+
+
+def track_cache(name, cache):
+    """Export hit ratio and size of an engine.LRUCache, read at scrape time."""
+    CACHE_HIT_RATIO.labels(name).set_function(cache.hit_ratio)
+    CACHE_ENTRIES.labels(name).set_function(lambda: len(cache))
+
+
+def record_cache_lookup(name, hit):
+    CACHE_REQUESTS.labels(name, "hit" if hit else "miss").inc()
+
+
+def set_catalog(size, version):
+    CATALOG_SIZE.set(size)
+    CATALOG_INFO.clear()
+    CATALOG_INFO.labels(version).set(1)
+
+
+def render():
+    """Return (body, content_type) for the /metrics endpoint."""
+    return generate_latest(), CONTENT_TYPE_LATEST
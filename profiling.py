@@ -0,0 +1,141 @@
+"""Slow-query log and opt-in sampling profiler for the serving path.
+
+Used by both api.py and the Streamlit app. Configuration comes from the
+environment:
+
+    SHL_SLOW_QUERY_MS         log queries slower than this (default 1000, 0 = off)
+    SHL_PROFILE_SAMPLE_RATE   fraction of queries to profile (default 0)
+    SHL_PROFILE_ALLOW_HEADER  honour "X-Profile: 1" on API requests (default off)
+    SHL_PROFILE_DIR           where traces are written (default ./profiles)
+
+Profiling needs the optional `pyinstrument` package; without it, profile
+requests are ignored and a warning is logged once.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from contextlib import contextmanager
+
+SLOW_QUERY_MS = float(os.environ.get("SHL_SLOW_QUERY_MS", "1000"))
+PROFILE_SAMPLE_RATE = float(os.environ.get("SHL_PROFILE_SAMPLE_RATE", "0"))
+ALLOW_PROFILE_HEADER = os.environ.get("SHL_PROFILE_ALLOW_HEADER", "0") == "1"
+PROFILE_DIR = os.environ.get("SHL_PROFILE_DIR", "profiles")
+PROFILE_HEADER = "X-Profile"
+
+logger = logging.getLogger("shl.slow_query")
+
+_warned_missing_profiler = False
+
+
+def should_profile(requested=False):
+    """Profile when explicitly requested (and allowed) or when sampled."""
+    if requested and ALLOW_PROFILE_HEADER:
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _start_profiler():
+    global _warned_missing_profiler
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        if not _warned_missing_profiler:
+            logger.warning("profiling requested but pyinstrument is not installed")
+            _warned_missing_profiler = True
+        return None
+
+    profiler = Profiler(interval=0.0005, async_mode="disabled")
+    profiler.start()
+    return profiler
+
+
+def _save_profile(profiler, source):
+    """Write the session (for `pyinstrument --load`) and an HTML view."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{source}-{uuid.uuid4().hex[:8]}"
+    base = os.path.join(PROFILE_DIR, profile_id)
+
+    profiler.last_session.save(base + ".pyisession")
+    with open(base + ".html", "w", encoding="utf-8") as f:
+        f.write(profiler.output_html())
+
+    return profile_id
+
+
+class QueryTrace:
+    """Collects stage timings for one query and handles slow-log / profiling.
+
+    Use as a context manager around the whole search and wrap each stage in
+    ``trace.stage(name)``. ``on_stage(name, seconds)`` is called as each stage
+    finishes, so callers can feed their own metrics from the same timings.
+    """
+
+    def __init__(self, query, source, profile=False, on_stage=None, token_counter=None):
+        self.query = query
+        self.source = source
+        self.profile = profile
+        self.on_stage = on_stage
+        self.token_counter = token_counter
+        self.stages = {}
+        self.result_count = None
+        self.profile_id = None
+        self._profiler = None
+        self._start = None
+
+    def __enter__(self):
+        if self.profile:
+            self._profiler = _start_profiler()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        total = time.perf_counter() - self._start
+
+        if self._profiler is not None:
+            self._profiler.stop()
+            try:
+                self.profile_id = _save_profile(self._profiler, self.source)
+            except OSError:
+                logger.exception("could not store profile")
+
+        if SLOW_QUERY_MS > 0 and total * 1000 >= SLOW_QUERY_MS:
+            self._log_slow(total)
+
+        return False
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed
+            if self.on_stage is not None:
+                self.on_stage(name, elapsed)
+
+    def _log_slow(self, total):
+        # Token counting is only done here, so fast queries never pay for it
+        tokens = None
+        if self.token_counter is not None:
+            try:
+                tokens = self.token_counter(self.query)
+            except Exception:
+                logger.debug("token count failed", exc_info=True)
+
+        record = {
+            "source": self.source,
+            "total_ms": round(total * 1000, 2),
+            "query_sha1": hashlib.sha1(self.query.encode("utf-8")).hexdigest()[:12],
+            "query_chars": len(self.query),
+            "query_tokens": tokens,
+            "stages_ms": {k: round(v * 1000, 3) for k, v in self.stages.items()},
+            "results": self.result_count,
+            "profile_id": self.profile_id,
+        }
+        logger.warning("slow query %s", json.dumps(record))
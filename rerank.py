@@ -0,0 +1,147 @@
+"""Optional cross-encoder re-ranking of the bi-encoder shortlist.
+
+    SHL_RERANK               "1" to enable (default off)
+    SHL_RERANK_MODEL         cross-encoder to use
+    SHL_RERANK_TOP_N         bi-encoder candidates to re-score (default 20)
+    SHL_RERANK_BUDGET_MS     total request budget (default 150); when the
+                             estimated re-score time would exceed what is left,
+                             the bi-encoder order is returned unchanged
+    SHL_RERANK_CACHE_SIZE    cached (query, assessment) scores (default 20000)
+
+Re-ranking only changes the order; the returned `score` stays the cosine
+similarity, so `min_score` keeps its meaning. In the API the cross-encoder
+shares the encoder gate with the bi-encoder, so both count against
+SHL_MAX_IN_FLIGHT; a batch that cannot get a slot within the budget falls
+back to the bi-encoder order.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import metrics
+from engine import LRUCache
+
+RERANK_ENABLED = os.environ.get("SHL_RERANK", "0") == "1"
+RERANK_MODEL = os.environ.get(
+    "SHL_RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2"
+)
+RERANK_TOP_N = int(os.environ.get("SHL_RERANK_TOP_N", "20"))
+RERANK_BUDGET_MS = float(os.environ.get("SHL_RERANK_BUDGET_MS", "150"))
+RERANK_CACHE_SIZE = int(os.environ.get("SHL_RERANK_CACHE_SIZE", "20000"))
+
+# Characters of description passed to the cross-encoder with the name
+DOC_TEXT_CHARS = 600
+
+logger = logging.getLogger("shl.rerank")
+
+
+def doc_text(doc):
+    return f"{doc['name']}. {doc.get('description', '')[:DOC_TEXT_CHARS]}"
+
+
+def query_hash(query):
+    return hashlib.sha1(query.encode("utf-8")).hexdigest()
+
+
+class Reranker:
+    def __init__(
+        self,
+        model_name=RERANK_MODEL,
+        top_n=RERANK_TOP_N,
+        budget_ms=RERANK_BUDGET_MS,
+        cache_size=RERANK_CACHE_SIZE,
+        gate=None,
+    ):
+        self.model_name = model_name
+        self.top_n = top_n
+        self.budget_s = budget_ms / 1000
+        self.cache = LRUCache(cache_size)
+        # admission.EncoderGate bounding concurrent predict() calls, if any
+        self.gate = gate
+        # Set when the cross-encoder fails to load; re-ranking is then skipped
+        # instead of retrying the load on every request
+        self.failed = False
+        self._model = None
+        self._model_lock = threading.Lock()
+        # Moving average of cross-encoder cost per (query, doc) pair
+        self._pair_s = 0.002
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+
+                    try:
+                        self._model = CrossEncoder(self.model_name)
+                    except Exception:
+                        self.failed = True
+                        raise
+        return self._model
+
+    def rerank(self, query, docs, ranked, elapsed_s=0.0):
+        """Re-order the first top_n (index, score) pairs by cross-encoder score.
+
+        `elapsed_s` is the time the request has already spent; if scoring the
+        uncached pairs is expected to overrun the budget, `ranked` is returned
+        as is. Returns (ranked, reranked?).
+        """
+        candidates = ranked[: self.top_n]
+        if len(candidates) < 2:
+            return ranked, False
+        if self.failed:
+            metrics.RERANK_FALLBACKS.labels("unavailable").inc()
+            return ranked, False
+
+        qhash = query_hash(query)
+        ce_scores = {}
+        missing = []
+        for idx, _ in candidates:
+            key = (qhash, docs[idx]["url"])
+            cached = self.cache.get(key)
+            if cached is None:
+                missing.append(idx)
+            else:
+                ce_scores[idx] = cached
+
+        if missing:
+            remaining = self.budget_s - elapsed_s
+            estimate = self._pair_s * len(missing)
+            if estimate > remaining:
+                metrics.RERANK_FALLBACKS.labels("budget").inc()
+                return ranked, False
+
+            if self.gate is not None:
+                # Only wait for a slot as long as the budget still allows
+                if not self.gate.try_acquire(remaining - estimate):
+                    metrics.RERANK_FALLBACKS.labels("queue").inc()
+                    return ranked, False
+
+            start = time.perf_counter()
+            try:
+                predicted = self.model.predict(
+                    [(query, doc_text(docs[idx])) for idx in missing],
+                    batch_size=len(missing),
+                )
+            except Exception:
+                logger.exception("cross-encoder failed; serving bi-encoder order")
+                metrics.RERANK_FALLBACKS.labels("error").inc()
+                return ranked, False
+            finally:
+                if self.gate is not None:
+                    self.gate.release(time.perf_counter() - start)
+            per_pair = (time.perf_counter() - start) / len(missing)
+            self._pair_s = 0.8 * self._pair_s + 0.2 * per_pair
+
+            for idx, score in zip(missing, predicted):
+                ce_scores[idx] = float(score)
+                self.cache.put((qhash, docs[idx]["url"]), float(score))
+
+        reordered = sorted(
+            candidates, key=lambda pair: ce_scores[pair[0]], reverse=True
+        )
+        return reordered + ranked[self.top_n :], True
@@ -0,0 +1,141 @@
+"""Popular-query log and cache warm-up.
+
+The API records every normalized query to a local log; on startup and after
+a catalog reload it replays the most frequent ones in batches to fill the
+embedding and result caches before reporting ready.
+
+    SHL_QUERY_LOG            log file (default query_log.tsv, empty = off)
+    SHL_WARMUP_QUERIES       how many of the top queries to replay (default 200)
+    SHL_WARMUP_BUDGET_S      stop warming after this many seconds (default 20)
+    SHL_WARMUP_BATCH_SIZE    queries per encode batch (default 64)
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+QUERY_LOG_PATH = os.environ.get("SHL_QUERY_LOG", "query_log.tsv")
+WARMUP_QUERIES = int(os.environ.get("SHL_WARMUP_QUERIES", "200"))
+WARMUP_BUDGET_S = float(os.environ.get("SHL_WARMUP_BUDGET_S", "20"))
+WARMUP_BATCH_SIZE = int(os.environ.get("SHL_WARMUP_BATCH_SIZE", "64"))
+
+logger = logging.getLogger("shl.warmup")
+
+
+class QueryLog:
+    """Append-only "count<TAB>query" log of normalized queries.
+
+    Counts are buffered in memory and appended in one write, so several
+    workers can share the file; readers sum the counts per query. Long
+    queries (pasted JDs) rarely repeat and are not worth keeping on disk.
+    """
+
+    def __init__(
+        self,
+        path,
+        flush_every=200,
+        flush_interval_s=30,
+        max_query_chars=500,
+        max_bytes=5_000_000,
+    ):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval_s = flush_interval_s
+        self.max_query_chars = max_query_chars
+        self.max_bytes = max_bytes
+        self._pending = Counter()
+        self._pending_total = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, query):
+        if not self.path or not query or len(query) > self.max_query_chars:
+            return
+        with self._lock:
+            self._pending[query] += 1
+            self._pending_total += 1
+            due = (
+                self._pending_total >= self.flush_every
+                or time.monotonic() - self._last_flush >= self.flush_interval_s
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            self._pending_total = 0
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+
+        lines = "".join(
+            f"{count}\t{query}\n"
+            for query, count in pending.items()
+            if "\n" not in query
+        )
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+    def _disk_counts(self):
+        totals = Counter()
+        if self.path and os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    count, _, query = line.rstrip("\n").partition("\t")
+                    if query and count.isdigit():
+                        totals[query] += int(count)
+        return totals
+
+    def counts(self):
+        totals = self._disk_counts()
+        with self._lock:
+            totals.update(self._pending)
+        return totals
+
+    def top(self, n):
+        return [query for query, _ in self.counts().most_common(n)]
+
+    def compact(self, keep=10000):
+        """Rewrite the log as one line per query once it grows past max_bytes.
+
+        Appends from other workers that land between the read and the rename
+        are lost, which only costs a few counts.
+        """
+        if not self.path or not os.path.exists(self.path):
+            return
+        if os.path.getsize(self.path) <= self.max_bytes:
+            return
+
+        # Pending counts are written as part of the rewrite, so they are taken
+        # out of the buffer here; otherwise the next flush() appends them twice
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            self._pending_total = 0
+            self._last_flush = time.monotonic()
+        totals = self._disk_counts()
+        totals.update(pending)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for query, count in totals.most_common(keep):
+                f.write(f"{count}\t{query}\n")
+        os.replace(tmp, self.path)
+
+
+def warm(queries, warm_batch, budget_s=WARMUP_BUDGET_S, batch_size=WARMUP_BATCH_SIZE):
+    """Call warm_batch on successive batches of queries until done or out of time.
+
+    Returns (queries warmed, seconds taken).
+    """
+    start = time.perf_counter()
+    warmed = 0
+    for i in range(0, len(queries), batch_size):
+        if time.perf_counter() - start >= budget_s:
+            logger.info("warm-up budget of %.1fs used up", budget_s)
+            break
+        batch = queries[i : i + batch_size]
+        warm_batch(batch)
+        warmed += len(batch)
+    return warmed, time.perf_counter() - start